@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import sys
+
+if sys.version_info[0] >= 3:
+    from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+else:
+    from PyQt4.QtCore import QObject, QTimer, pyqtSignal
+
+
+class BackgroundSync(QObject):
+    ''' Keeps the catalog collections of a ShogunRessource up to date while
+    the editor is open. Every interval seconds they are revalidated with
+    conditional requests that do not block (see
+    ShogunRessource.syncCatalogs()), a sync that finds nothing new doubles
+    the interval up to maxInterval, a change resets it.
+
+    added, changed and removed are emitted with the name of the collection
+    ('applications', 'layers', 'extents' or 'mapconfigs') and the ids of the
+    entities concerned'''
+
+    added = pyqtSignal(str, list)
+    changed = pyqtSignal(str, list)
+    removed = pyqtSignal(str, list)
+
+    def __init__(self, ressource, interval = 60, maxInterval = 900):
+        QObject.__init__(self)
+        self.ressource = ressource
+        self.interval = interval
+        self.maxInterval = maxInterval
+        self.currentInterval = interval
+        self.active = False
+        self.running = False
+        # the errors of the last sync by endpoint
+        self.errors = {}
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.sync)
+
+    def start(self):
+        self.active = True
+        self.currentInterval = self.interval
+        self.schedule()
+
+    def stop(self):
+        self.active = False
+        self.timer.stop()
+
+    def isActive(self):
+        return self.active
+
+    def schedule(self):
+        if self.active and not self.running:
+            self.timer.start(int(self.currentInterval * 1000))
+
+    def sync(self):
+        if self.running:
+            return
+        self.running = True
+        self.ressource.syncCatalogs(self.synced)
+
+    def synced(self, deltas, errors):
+        self.running = False
+        self.errors = errors
+        changes = False
+        for attr, delta in deltas.items():
+            if delta.isEmpty():
+                continue
+            changes = True
+            if len(delta.removed) > 0:
+                self.removed.emit(attr, delta.removed)
+            if len(delta.changed) > 0:
+                self.changed.emit(attr, delta.changed)
+            if len(delta.added) > 0:
+                self.added.emit(attr, delta.added)
+        if changes:
+            self.currentInterval = self.interval
+        else:
+            self.currentInterval = min(self.currentInterval * 2, self.maxInterval)
+        self.schedule()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import json
+import hashlib
+from collections import OrderedDict
+
+
+class CatalogStore():
+    ''' An id-indexed store for the entities of one Shogun collection
+    (applications, layers, extents or mapconfigs) as they are returned by the
+    REST interface. Lookup, replacement and removal by id are O(1), iterating
+    yields the entities in the order the server returned them. version is
+    increased on every change, so views can tell whether they are outdated.
+
+    With summaryFields only these fields of the entities of a whole
+    collection are kept (see project()), together with the fields derive
+    returns for an entity. An entity stored with put() is kept completely
+    and is detailed. A detailed entity stays detailed when the
+    collection is replaced and its 'modified' timestamp has not changed'''
+
+    def __init__(self, entities = None, summaryFields = None, derive = None):
+        self.entities = OrderedDict()
+        self.version = 0
+        self.summaryFields = summaryFields
+        self.derive = derive
+        # the ids of the entities that are stored completely
+        self.detailed = set()
+        if entities is not None:
+            self.replaceAll(entities)
+
+    def project(self, entity):
+        if self.summaryFields is None:
+            return entity
+        summary = {field: entity[field] for field in self.summaryFields
+                   if field in entity}
+        if self.derive is not None:
+            summary.update(self.derive(entity))
+        return summary
+
+    def replaceAll(self, entities):
+        old = self.entities
+        self.entities = OrderedDict()
+        detailed = set()
+        for entity in entities:
+            id = entity['id']
+            if id in self.detailed and self.unchanged(old[id], entity):
+                self.entities[id] = old[id]
+                detailed.add(id)
+            else:
+                self.entities[id] = self.project(entity)
+        if self.summaryFields is None:
+            detailed = set(self.entities.keys())
+        self.detailed = detailed
+        self.version += 1
+
+    def restore(self, entities, detailed):
+        # entities as they were stored before, the ones in detailed complete
+        self.entities = OrderedDict((entity['id'], entity) for entity in entities)
+        if self.summaryFields is None:
+            self.detailed = set(self.entities.keys())
+        else:
+            self.detailed = set(detailed)
+        self.version += 1
+
+    def unchanged(self, entity, summary):
+        modified = summary.get('modified')
+        return modified is not None and entity.get('modified') == modified
+
+    def isDetailed(self, id):
+        return id in self.detailed
+
+    def get(self, id):
+        return self.entities.get(id)
+
+    def put(self, entity):
+        # an existing entity keeps its position, a new one is appended
+        self.entities[entity['id']] = entity
+        self.detailed.add(entity['id'])
+        self.version += 1
+
+    def remove(self, id):
+        if id not in self.entities:
+            return None
+        self.version += 1
+        self.detailed.discard(id)
+        return self.entities.pop(id)
+
+    def ids(self):
+        return list(self.entities.keys())
+
+    def values(self):
+        return list(self.entities.values())
+
+    def __iter__(self):
+        return iter(list(self.entities.values()))
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, id):
+        return id in self.entities
+
+    def markers(self):
+        return {id: catalogMarker(self.project(entity))
+                for id, entity in self.entities.items()}
+
+    def diff(self, markers):
+        ''' Compares the store with the markers (id -> catalogMarker()) of an
+        older state of it and returns a CatalogDelta'''
+        current = self.markers()
+        added = [id for id in current if id not in markers]
+        removed = [id for id in markers if id not in current]
+        changed = [id for id in current
+                   if id in markers and markers[id] != current[id]]
+        return CatalogDelta(added, removed, changed)
+
+
+class CatalogDelta():
+    ''' The ids of the entities that were added, removed or changed between
+    two states of a CatalogStore'''
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def isEmpty(self):
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+
+def catalogMarker(entity):
+    ''' Returns what tells whether an entity has changed: its 'modified'
+    timestamp or, for entities without one, a hash of their content'''
+    modified = entity.get('modified')
+    if modified is not None:
+        return modified
+    text = json.dumps(entity, sort_keys = True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# the characters that matter when looking for the end of an element
+STRUCTURE = re.compile(r'[\[\]{}",]')
+NESTED = re.compile(r'[\[\]{}"]')
+STRING = re.compile(r'["\\]')
+
+
+class JsonArrayStream():
+    ''' A sink for NetworkAccessManager requests that parses a JSON array
+    while it arrives. Every element is parsed as soon as it is complete and
+    passed to onEntity, only the text of the element that has not arrived
+    completely is buffered. The end of that element is searched for only in
+    the text that arrived since the last chunk, it is decoded once it is
+    complete. If given, transform is applied to every element before it is
+    kept and passed on. If path is given, the raw bytes are written to that
+    file as well (the response cache stores it from there).
+
+    Errors while parsing or writing do not interrupt the transfer, they are
+    raised by result() which returns the list of all elements. reset()
+    starts over for a body that is sent again, onEntity then sees the
+    elements that had already arrived once more'''
+
+    # an element that is still not complete with this much text buffered is
+    # taken as malformed
+    MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, onEntity = None, path = None, transform = None):
+        self.onEntity = onEntity
+        self.transform = transform
+        self.path = path
+        self.file = None
+        self.jsonDecoder = json.JSONDecoder()
+        self.reset()
+
+    def reset(self):
+        self.close()
+        self.file = open(self.path, 'wb') if self.path is not None else None
+        self.entities = []
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = u''
+        # 'start', 'first' (value or end), 'value', 'separator' or 'complete'
+        self.state = 'start'
+        self.error = None
+        # where the search for the end of the element at the start of text
+        # goes on, None between elements, and the nesting at that point
+        self.elementScan = None
+        self.depth = 0
+        self.inString = False
+
+    def write(self, data):
+        try:
+            if self.file is not None:
+                self.file.write(data)
+            if self.error is not None or self.state == 'complete':
+                return
+            self.text += self.decoder.decode(data)
+            self.scan()
+        except (ValueError, IOError, OSError) as e:
+            if self.error is None:
+                self.error = e
+            self.text = u''
+
+    def scan(self):
+        text = self.text
+        pos = 0
+        while self.state != 'complete':
+            if self.elementScan is None:
+                pos = WHITESPACE.match(text, pos).end()
+                if pos == len(text):
+                    break
+                char = text[pos]
+                if self.state == 'start':
+                    if char != '[':
+                        raise ValueError('The response is not a JSON array')
+                    self.state = 'first'
+                    pos += 1
+                    continue
+                elif self.state == 'separator' or (self.state == 'first' and char == ']'):
+                    if char == ']':
+                        self.state = 'complete'
+                    elif char == ',':
+                        self.state = 'value'
+                    else:
+                        raise ValueError('Unexpected {0!r} in the JSON array'.format(char))
+                    pos += 1
+                    continue
+                self.elementScan = pos
+                self.depth = 0
+                self.inString = False
+            if not self.findElementEnd(text):
+                break
+            entity, end = self.jsonDecoder.raw_decode(text, pos)
+            self.emit(entity)
+            self.state = 'separator'
+            self.elementScan = None
+            pos = end
+        # the text that is left starts with the incomplete element
+        self.text = text[pos:]
+        if self.elementScan is not None:
+            self.elementScan -= pos
+        if len(self.text) > self.MAX_ELEMENT_SIZE:
+            raise ValueError('Malformed JSON array element')
+
+    def findElementEnd(self, text):
+        ''' Goes on searching for the end of the current element from
+        elementScan, returns True once it has been found'''
+        pos = self.elementScan
+        while True:
+            if self.inString:
+                match = STRING.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(text):
+                        # the escaped character is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.inString = False
+                pos = match.end()
+                if self.depth == 0:
+                    return True
+                continue
+            # a comma only ends an element outside of arrays and objects
+            if self.depth == 0:
+                match = STRUCTURE.search(text, pos)
+            else:
+                match = NESTED.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self.inString = True
+            elif char in '[{':
+                self.depth += 1
+            elif char in ']}':
+                # at depth 0 this ends the array after a number or literal
+                if self.depth == 0:
+                    return True
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+            elif self.depth == 0:
+                return True
+        self.elementScan = pos
+        return False
+
+    def emit(self, entity):
+        if self.transform is not None:
+            entity = self.transform(entity)
+        self.entities.append(entity)
+        if self.onEntity is not None:
+            self.onEntity(entity)
+
+    def flush(self):
+        if self.file is not None and not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+
+    def result(self):
+        self.close()
+        if self.error is not None:
+            raise self.error
+        if self.state != 'complete':
+            raise ValueError('The JSON array ended before it was complete')
+        return self.entities
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+from collections import OrderedDict
+
+
+def sortedChildren(node):
+    ''' Returns the children of a folder of a Shogun layer tree in the order
+    of their index, which is the order Shogun shows them in'''
+    children = node.get('children') or []
+    return sorted(children, key = lambda child: child.get('index', 0))
+
+
+def layerPathsOfTree(layerTree):
+    ''' Returns the layers of a Shogun layer tree at any depth as an
+    OrderedDict of layer id -> path, in the order they appear in the tree
+    (see sortedChildren()).
+    The path is the tuple of the names of the folders above the layer,
+    without the root folder'''
+    paths = OrderedDict()
+    if layerTree is None:
+        return paths
+    stack = [(layerTree, None)]
+    while len(stack) > 0:
+        node, path = stack.pop()
+        if node.get('leaf'):
+            layer = node.get('layer')
+            if layer is not None and layer.get('id') not in paths:
+                paths[layer['id']] = path or ()
+        else:
+            if path is None:
+                childPath = ()
+            else:
+                childPath = path + (node.get('text'),)
+            # reversed, so that the first child is visited first
+            for child in reversed(sortedChildren(node)):
+                stack.append((child, childPath))
+    return paths
+
+
+def layerIdsOfTree(layerTree):
+    ''' Returns the ids of all layers in a Shogun layer tree, at any depth,
+    in the order they appear in the tree'''
+    return list(layerPathsOfTree(layerTree).keys())
+
+
+def applicationLayerIds(application):
+    ''' Returns the ids of the layers an application uses, from its summary
+    (see ShogunRessource.APPLICATION_SUMMARY) or from its layer tree'''
+    if 'layerIds' in application:
+        return application['layerIds']
+    return layerIdsOfTree(application.get('layerTree'))
+
+
+class LayerIndex():
+    ''' The reverse index of which applications use a layer, built from the
+    applications store. It is rebuilt when it is used the first time after
+    the store has changed, so it follows every reload and sync.
+
+    The resolved layer trees of applications (see layerPaths()) are memoized
+    until the layer tree of the application is replaced'''
+
+    def __init__(self, applications):
+        self.applications = applications
+        self.version = None
+        # layer id -> set of application ids
+        self.index = {}
+        # application id -> (layerTree, paths)
+        self.resolved = {}
+
+    def refresh(self):
+        if self.version == self.applications.version:
+            return
+        self.index = {}
+        for application in self.applications:
+            for layerId in applicationLayerIds(application):
+                self.index.setdefault(layerId, set()).add(application['id'])
+        self.version = self.applications.version
+        for id in list(self.resolved.keys()):
+            if id not in self.applications:
+                del self.resolved[id]
+
+    def applicationsUsing(self, layerId):
+        self.refresh()
+        return set(self.index.get(layerId, set()))
+
+    def usedLayerIds(self):
+        self.refresh()
+        return set(self.index.keys())
+
+    def layerPaths(self, applicationId, layerTree):
+        ''' Returns layerPathsOfTree() of the layer tree of an application.
+        The entities in the store are replaced, not changed, when an
+        application is updated, so a layer tree that is the same object
+        resolves to the same layers'''
+        self.refresh()
+        cached = self.resolved.get(applicationId)
+        if cached is not None and cached[0] is layerTree:
+            return cached[1]
+        paths = layerPathsOfTree(layerTree)
+        self.resolved[applicationId] = (layerTree, paths)
+        return paths
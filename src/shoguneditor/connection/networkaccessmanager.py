@@ -26,80 +26,715 @@ __author__ = 'Alessandro Pasotti'
 __date__ = 'August 2016'
 
 import sys
+import time
+import random
+import json
+import shutil
+import os
+import hmac
+import hashlib
+from email.utils import parsedate_tz, mktime_tz
+
+if sys.version_info[0] >= 3:
+    from urllib.parse import urlsplit
+else:
+    from urlparse import urlsplit
 
 if sys.version_info[0] >= 3:
     from qgis.PyQt.QtCore import QUrl
-    from qgis.PyQt.QtCore import pyqtSlot, QEventLoop
+    from qgis.PyQt.QtCore import pyqtSlot, QEventLoop, QTimer
     from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
     import urllib
 else:
     from PyQt4.QtCore import QUrl
-    from PyQt4.QtCore import pyqtSlot, QEventLoop
+    from PyQt4.QtCore import pyqtSlot, QEventLoop, QTimer
     from PyQt4.QtNetwork import QNetworkRequest, QNetworkReply
     import urllib2
 
 from qgis.core import QgsNetworkAccessManager, QgsAuthManager, QgsMessageLog
 
+# a faster JSON parser is used for responses if one is installed
+try:
+    import orjson as fastjson
+except ImportError:
+    try:
+        import ujson as fastjson
+    except ImportError:
+        fastjson = None
+
 # FIXME: ignored
 DEFAULT_MAX_REDIRECTS = 4
 
+# the amount of data Qt buffers for a reply that is streamed to a sink
+STREAM_BUFFER_SIZE = 256 * 1024
+
+# the HTTP statuses of a server that is overloaded or unreachable behind a
+# gateway, worth a retry and counted as failures of the host
+TRANSIENT_STATUS = (502, 503, 504)
+
+# the key of the hashes that stand in for unnamed credentials, it only lives
+# in memory
+IDENTITY_KEY = os.urandom(32)
+
 class RequestsException(Exception):
     pass
 
 class RequestsExceptionTimeout(RequestsException):
-    pass
+    """
+    phase tells which timeout expired: 'firstByte' if no response arrived
+    in time (the host or the endpoint is slow, or the host is down), 'idle'
+    if a started response stalled or 'total' if the request took too long.
+    """
+    def __init__(self, msg, phase = None):
+        RequestsException.__init__(self, msg)
+        self.phase = phase
 
 class RequestsExceptionConnectionError(RequestsException):
     pass
 
-class Map(dict):
+class RequestsExceptionCancelled(RequestsException):
+    pass
+
+class RequestsExceptionCircuitOpen(RequestsExceptionConnectionError):
+    pass
+
+PYTHON_VERSION = sys.version_info[0]
+
+def headerText(value):
+    """Return a raw header name or value (a QByteArray) as a string"""
+    if PYTHON_VERSION >= 3:
+        return value.data().decode('latin-1')
+    return str(value)
+
+def pathMatches(path, cookiePath):
+    """Whether a cookie with the Path cookiePath is sent to path (RFC 6265)"""
+    if path == cookiePath or cookiePath == '/':
+        return True
+    if not cookiePath.endswith('/'):
+        cookiePath += '/'
+    return path.startswith(cookiePath)
+
+
+class Response(object):
     """
-    Example:
-    m = Map({'first_name': 'Eduardo'}, last_name='Pool', age=24, sports=['Soccer'])
+    The result of a request. Only the raw headers and body are kept, the
+    headers are decoded to a dict with lowercase names, the body to text
+    and JSON when they are used for the first time.
+
+    A Response also stands in for the (response, content) tuple of httplib2:
+    response[0] is the response itself, response[1] the text, and it can be
+    unpacked with (response, content) = ... . Any other key returns the
+    attribute of that name, e.g. response['status'].
     """
-    def __init__(self, *args, **kwargs):
-        super(Map, self).__init__(*args, **kwargs)
-        for arg in args:
-            if isinstance(arg, dict):
-                for k, v in arg.items():
-                    self[k] = v
 
-        if kwargs:
-            for k, v in kwargs.items():
-                self[k] = v
+    __slots__ = ('status', 'status_message', 'content', 'ok', 'reason',
+                 'exception', 'notModified', 'fromCache', 'bytesReceived',
+                 'attempts', 'rawHeaders', '_headers', '_text')
 
-    def __getattr__(self, attr):
-        return self.get(attr)
+    def __init__(self, attempts = 1):
+        self.status = 0
+        self.status_message = ''
+        self.content = b''
+        self.ok = False
+        self.reason = ''
+        self.exception = None
+        self.notModified = False
+        self.fromCache = False
+        self.bytesReceived = 0
+        self.attempts = attempts
+        # (name, value) QByteArray pairs as returned by Qt
+        self.rawHeaders = []
+        self._headers = None
+        self._text = None
 
-    def __setattr__(self, key, value):
-        self.__setitem__(key, value)
+    @property
+    def status_code(self):
+        return self.status
 
-    def __setitem__(self, key, value):
-        super(Map, self).__setitem__(key, value)
-        self.__dict__.update({key: value})
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = {headerText(k).lower(): headerText(v)
+                             for k, v in self.rawHeaders}
+        return self._headers
 
-    def __delattr__(self, item):
-        self.__delitem__(item)
+    @headers.setter
+    def headers(self, headers):
+        self._headers = {k.lower(): v for k, v in headers.items()}
 
-    def __delitem__(self, key):
-        super(Map, self).__delitem__(key)
-        del self.__dict__[key]
+    def setRawHeaders(self, rawHeaders):
+        self.rawHeaders = rawHeaders
+        self._headers = None
 
+    @property
+    def text(self):
+        if self._text is None:
+            if PYTHON_VERSION >= 3:
+                # binary payloads must not break the request, the raw bytes
+                # are kept in content anyway
+                self._text = self.content.decode('utf-8', 'replace')
+            else:
+                self._text = self.content
+        return self._text
 
-class Response(Map):
-    pass
+    def setContent(self, content):
+        self.content = content
+        self._text = None
+
+    def json(self):
+        # parsed from the body bytes, the text is not needed for this
+        return loadJson(self.content)
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self
+        if key == 1:
+            return self.text
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield self
+        yield self.text
+
+
+def loadJson(data):
+    """
+    Parse JSON from bytes (or a memoryview of them) without decoding them to
+    a string first, with orjson or ujson if one of them is installed
+    """
+    if fastjson is not None and fastjson.__name__ == 'orjson':
+        return fastjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if fastjson is not None:
+        return fastjson.loads(data)
+    # json.loads() only accepts bytes since Python 3.6
+    if PYTHON_VERSION >= 3 and isinstance(data, bytes) and sys.version_info[1] < 6:
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def formatBytes(size):
+    for unit in ['B', 'KB', 'MB']:
+        if abs(size) < 1024.0:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
+
+
+class TransferStats():
+    """Bytes transferred, rate and estimated time left of a running transfer"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.bytes = 0
+        self.total = -1
+
+    def update(self, bytes, total):
+        self.bytes = bytes
+        self.total = total
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def rate(self):
+        """Bytes per second since the transfer started"""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes / elapsed
+
+    def fraction(self):
+        if self.total <= 0:
+            return None
+        return float(self.bytes) / self.total
+
+    def eta(self):
+        """Seconds left until the transfer is done, None if unknown"""
+        rate = self.rate()
+        if self.total <= 0 or rate <= 0:
+            return None
+        return (self.total - self.bytes) / rate
+
+    def __str__(self):
+        text = formatBytes(self.bytes)
+        if self.total > 0:
+            text += ' of ' + formatBytes(self.total)
+        text += ', ' + formatBytes(self.rate()) + '/s'
+        eta = self.eta()
+        if eta is not None:
+            text += ', %d s left' % eta
+        return text
+
+
+class Timeouts():
+    """
+    The timeouts of a request in seconds, None disables a timeout.
+
+    firstByte: until the first byte of the response arrives (or the request
+        body is accepted), this includes the time the server needs to
+        prepare the response, not only the connect
+    idle: without a single byte sent or received once the transfer started
+    total: for the whole request
+    """
+
+    def __init__(self, firstByte = 90, idle = 60, total = None):
+        self.firstByte = firstByte
+        self.idle = idle
+        self.total = total
+
+
+class RetryPolicy():
+    """
+    Decides if and when a failed request is sent again. Only idempotent
+    methods are retried, after an exponential backoff with random jitter or
+    after the delay the server asked for in a Retry-After header.
+    """
+
+    # network errors that are worth another try
+    RETRY_ERRORS = [
+        QNetworkReply.RemoteHostClosedError,
+        QNetworkReply.TimeoutError,
+        QNetworkReply.TemporaryNetworkFailureError
+    ]
+
+    def __init__(self, maxRetries = 3, backoffFactor = 0.5, maxBackoff = 30.0,
+                 jitter = 0.5, retryStatus = TRANSIENT_STATUS,
+                 methods = ('GET', 'HEAD', 'PUT', 'DELETE')):
+        self.maxRetries = maxRetries
+        self.backoffFactor = backoffFactor
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.retryStatus = retryStatus
+        self.methods = methods
+
+    def shouldRetry(self, method, attempt, status, error):
+        if method not in self.methods or attempt >= self.maxRetries:
+            return False
+        return status in self.retryStatus or error in self.RETRY_ERRORS
+
+    def delay(self, attempt, retryAfter = None):
+        """Seconds to wait before the retry following attempt (0 based)"""
+        seconds = parseRetryAfter(retryAfter)
+        if seconds is None:
+            seconds = self.backoffFactor * (2 ** attempt)
+            seconds *= 1 - self.jitter * random.random()
+        return max(0.0, min(seconds, self.maxBackoff))
+
+
+def parseRetryAfter(value):
+    """Return the seconds of a Retry-After header value, None if invalid"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return mktime_tz(date) - time.time()
+
+
+class CircuitBreaker():
+    """
+    Fails requests to one host fast once failureThreshold requests in a row
+    have failed with a connection error or a transient status. After
+    resetTimeout seconds a single trial request is let through again, all
+    others are rejected until it has finished. Its success closes the
+    circuit, its failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failureThreshold = 5, resetTimeout = 30.0):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = 0
+        self.trialInFlight = False
+
+    def allowRequest(self):
+        if self.state == self.OPEN:
+            if time.time() - self.openedAt < self.resetTimeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.trialInFlight = False
+        if self.state == self.HALF_OPEN:
+            if self.trialInFlight:
+                return False
+            self.trialInFlight = True
+        return True
+
+    def releaseTrial(self):
+        # the trial request was cancelled, the next one may be the trial
+        self.trialInFlight = False
+
+    def recordSuccess(self):
+        self.failures = 0
+        self.state = self.CLOSED
+        self.trialInFlight = False
+
+    def recordFailure(self):
+        self.trialInFlight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failureThreshold:
+            self.state = self.OPEN
+            self.openedAt = time.time()
+
+
+class PendingRequest():
+    """
+    The state of a single request sent with NetworkAccessManager.requestAsync().
+
+    Every pending request owns its QNetworkReply and its Response, so any
+    number of requests can be in flight at the same time. Callbacks added with
+    addCallback() are called with the pending request as only argument as soon
+    as the reply has finished; result() returns the same (response, content)
+    Response as NetworkAccessManager.request() or raises its exception.
+
+    If a sink (a file path or an object with a write() method) is given, the
+    body of a successful (2xx) response is written to it chunk by chunk
+    while it arrives instead of being kept in the response, the body of any
+    other response is kept in the response as usual. A sink object with a
+    path attribute keeps a copy of the body in that file. The sink is closed
+    when the request is done; before a retry a file sink is truncated and a
+    sink object is reset() if it has that method. progress is called with
+    the downloadStats while the body is received, uploadProgress with the
+    uploadStats while the request body is sent. cancel() aborts the request,
+    result() then raises RequestsExceptionCancelled.
+
+    A GET coalesced with an identical one already in flight has no reply of
+    its own: it is a follower of that leader and gets its response when the
+    leader has finished. Cancelling a leader with followers does not abort
+    the transfer they are still waiting for.
+    """
+
+    def __init__(self, nam, url, method, sink = None, progress = None, uploadProgress = None, timeouts = None):
+        self.nam = nam
+        self.url = url
+        self.method = method.upper()
+        self.reply = None
+        self.finished = False
+        self.callbacks = []
+        self.cacheKey = None
+        self.authenticate = True
+        # the key in nam.inflight if other requests can be coalesced with
+        # this one, the leader this request is coalesced with and the
+        # requests coalesced with this one
+        self.coalesceKey = None
+        self.leader = None
+        self.followers = []
+        self.sink = sink
+        self.sinkPath = None
+        # the bytes written to the sink, and the chunks of a body that is
+        # not written to it because the response is not a success
+        self.sinkBytes = 0
+        self.unsinkedBody = []
+        self.progress = progress
+        self.uploadProgress = uploadProgress
+        self.cancelled = False
+        self.downloadStats = TransferStats()
+        self.uploadStats = TransferStats()
+        # the QNetworkRequest and body, kept for sending retries
+        self.req = None
+        self.body = None
+        self.attempt = 0
+        self.timeouts = timeouts if timeouts is not None else nam.timeouts
+        self.timeoutPhase = None
+        self.timers = {}
+        if sink is not None and not hasattr(sink, 'write'):
+            self.sinkPath = sink
+            self.sink = open(sink, 'wb')
+        self.http_call_result = self.newResponse()
+
+    def newResponse(self):
+        return Response(attempts = self.attempt + 1)
+
+    def addCallback(self, callback):
+        if self.finished:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def isFinished(self):
+        return self.finished
+
+    def wait(self):
+        """Process events in a local event loop until the request has finished"""
+        self.nam.waitForAll([self])
+
+    def result(self):
+        """
+        Wait for the request and return its Response, raises the same
+        exceptions as NetworkAccessManager.request()
+        """
+        self.wait()
+        result = self.http_call_result
+        if not result.ok:
+            if result.exception and not self.nam.exception_class:
+                raise result.exception
+            elif self.nam.exception_class:
+                raise self.nam.exception_class(result.reason)
+            else:
+                raise RequestsException(result.reason)
+        return result
+
+    def abort(self):
+        if self.reply is not None and self.reply.isRunning():
+            self.reply.abort()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.leader is not None:
+            self.leader.followers.remove(self)
+            self.leader = None
+            self.http_call_result = self.cancelledResponse()
+            self.done()
+        elif len(self.followers) == 0:
+            self.abort()
+
+    def cancelledResponse(self):
+        result = self.newResponse()
+        result.reason = 'Request was cancelled'
+        result.exception = RequestsExceptionCancelled(result.reason)
+        return result
+
+    def follow(self, leader):
+        self.leader = leader
+        leader.followers.append(self)
+
+    def share(self, result):
+        # called by the leader with its response
+        self.leader = None
+        self.http_call_result = result
+        self.done()
+
+    def setReply(self, reply):
+        self.reply = reply
+        self.downloadStats = TransferStats()
+        self.uploadStats = TransferStats()
+        self.reply.sslErrors.connect(
+            lambda errors: self.nam.sslErrors(self.reply, errors))
+        self.reply.downloadProgress.connect(
+            lambda received, total: self.nam.downloadProgress(self, received, total))
+        self.reply.uploadProgress.connect(
+            lambda sent, total: self.nam.uploadProgress(self, sent, total))
+        self.reply.metaDataChanged.connect(self.transferActive)
+        self.reply.downloadProgress.connect(self.transferActive)
+        self.reply.uploadProgress.connect(self.transferActive)
+        if self.sink is not None:
+            self.reply.setReadBufferSize(STREAM_BUFFER_SIZE)
+            self.reply.readyRead.connect(self.readyRead)
+        self.reply.finished.connect(self.replyFinished)
+        self.timeoutPhase = None
+        self.startTimer('firstByte', self.timeouts.firstByte)
+        self.startTimer('total', self.timeouts.total)
+
+    def startTimer(self, phase, seconds):
+        if seconds is None:
+            return
+        if phase not in self.timers:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self.timedOut(phase))
+            self.timers[phase] = timer
+        self.timers[phase].start(int(seconds * 1000))
+
+    def stopTimers(self):
+        for timer in self.timers.values():
+            timer.stop()
+
+    def transferActive(self, *args):
+        # the server answers or accepts data: the first byte timeout is over
+        # and the idle timeout starts again with every chunk
+        if 'firstByte' in self.timers:
+            self.timers['firstByte'].stop()
+        self.startTimer('idle', self.timeouts.idle)
+
+    def timedOut(self, phase):
+        if self.reply is None:
+            return
+        self.timeoutPhase = phase
+        self.abort()
+
+    #@pyqtSlot()
+    def readyRead(self):
+        data = self.reply.readAll()
+        if PYTHON_VERSION >= 3:
+            data = data.data()
+        else:
+            data = str(data)
+        self.writeSink(data)
+
+    def writeSink(self, data):
+        if not self.isSuccess():
+            self.unsinkedBody.append(data)
+            return
+        self.sink.write(data)
+        self.sinkBytes += len(data)
+        self.http_call_result.bytesReceived += len(data)
+
+    def isSuccess(self):
+        status = self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        return status is None or 200 <= status < 300
+
+    def bodyPath(self):
+        # the file a streamed body has been written to, a sink object can
+        # name it in its path attribute
+        if self.sinkPath is not None:
+            return self.sinkPath
+        return getattr(self.sink, 'path', None)
+
+    def flushSink(self):
+        # the file of a streamed body must be complete before it is cached
+        if self.sink is not None and hasattr(self.sink, 'flush'):
+            self.sink.flush()
+
+    def closeSink(self):
+        if self.sinkPath is not None:
+            if not self.sink.closed:
+                self.sink.close()
+        elif self.bodyPath() is not None:
+            self.sink.close()
+
+    def resetSink(self):
+        self.sinkBytes = 0
+        self.unsinkedBody = []
+        if self.sinkPath is not None:
+            if not self.sink.closed:
+                self.sink.close()
+            self.sink = open(self.sinkPath, 'wb')
+        elif hasattr(self.sink, 'reset'):
+            self.sink.reset()
+
+    def canResend(self):
+        # a body already written to a sink cannot be taken back unless the
+        # sink can start over
+        if self.sink is None or self.sinkBytes == 0:
+            return True
+        return self.sinkPath is not None or hasattr(self.sink, 'reset')
+
+    #@pyqtSlot()
+    def replyFinished(self):
+        self.stopTimers()
+        if self.sink is not None:
+            self.readyRead()
+            self.flushSink()
+        self.nam.fillResponse(self.reply, self.http_call_result,
+                              readBody = self.sink is None)
+        if len(self.unsinkedBody) > 0:
+            self.nam.setBody(self.http_call_result, b''.join(self.unsinkedBody))
+        self.nam.updateSession(self)
+        # a cancelled leader keeps the transfer going for its followers
+        abandoned = self.cancelled and len(self.followers) == 0
+        if abandoned:
+            self.nam.circuitBreaker(self.url).releaseTrial()
+            self.http_call_result.ok = False
+            self.http_call_result.reason = 'Request was cancelled'
+            self.http_call_result.exception = RequestsExceptionCancelled(
+                self.http_call_result.reason)
+        elif self.timeoutPhase is not None:
+            self.http_call_result.ok = False
+            self.http_call_result.reason = self.timeoutMessage()
+            self.http_call_result.exception = RequestsExceptionTimeout(
+                self.http_call_result.reason, self.timeoutPhase)
+        if self.method == 'GET' and self.http_call_result.status == 200:
+            self.nam.storeValidators(self.url, self.http_call_result)
+            if self.cacheKey is not None and self.http_call_result.ok:
+                if self.sink is None:
+                    self.nam.cache.put(self.cacheKey, self.url,
+                        self.http_call_result.status,
+                        self.http_call_result.headers,
+                        body = self.http_call_result.content)
+                elif self.bodyPath() is not None:
+                    self.nam.cache.put(self.cacheKey, self.url,
+                        self.http_call_result.status,
+                        self.http_call_result.headers,
+                        path = self.bodyPath())
+        self.nam.logResponse(self.reply, self.http_call_result)
+        retry = not abandoned and (self.nam.reauthenticate(self)
+                                   or self.nam.retryLater(self))
+        self.reply.deleteLater()
+        self.reply = None
+        if not retry:
+            self.done()
+
+    def timeoutMessage(self):
+        if self.timeoutPhase == 'firstByte':
+            return 'No response to {0} within {1} s, the server is slow or unreachable'.format(
+                self.url, self.timeouts.firstByte)
+        elif self.timeoutPhase == 'idle':
+            return 'Request to {0} stalled, no data for {1} s'.format(
+                self.url, self.timeouts.idle)
+        return 'Request to {0} did not complete within {1} s'.format(
+            self.url, self.timeouts.total)
+
+    def resend(self):
+        if self.cancelled and len(self.followers) == 0:
+            self.done()
+            return
+        self.attempt += 1
+        self.http_call_result = self.newResponse()
+        if self.sink is not None:
+            self.resetSink()
+        self.nam.dispatch(self)
+
+    def done(self):
+        if self.sink is not None:
+            self.closeSink()
+        if self.coalesceKey is not None:
+            self.nam.inflight.pop(self.coalesceKey, None)
+            self.coalesceKey = None
+        followers = self.followers
+        self.followers = []
+        for follower in followers:
+            follower.share(self.http_call_result)
+        if self.cancelled and self.http_call_result.exception is None:
+            self.http_call_result = self.cancelledResponse()
+        self.finished = True
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            callback(self)
 
-PYTHON_VERSION = sys.version_info[0]
 
 class NetworkAccessManager():
     """
     This class mimicks httplib2 by using QgsNetworkAccessManager for all
-    network calls.
+    network calls, or the QNetworkAccessManager given as manager (see
+    createNetworkManager()). Requests sent with an own manager allow HTTP/2,
+    so that servers supporting it multiplex all requests over one
+    connection.
 
-    The return value is a tuple of (response, content), the first being and
-    instance of the Response class, the second being a string that contains
+    The return value is a Response, it can be used like the (response,
+    content) tuple of httplib2, the second item being a string that contains
     the response entity body.
 
+    Besides the blocking request(), requestAsync() sends a request without
+    waiting for it and returns a PendingRequest, so that several requests
+    can run at the same time.
+
+    If a ResponseCache is set with setCache(), GET responses are served from
+    and stored in it unless a request is sent with useCache = False. Every
+    other method invalidates the cached responses of the same host.
+
+    In session mode (setSessionMode()) the Basic credentials are only sent
+    until the server has set a session cookie, every following request only
+    carries that cookie. A request rejected with 401 Unauthorized because
+    the session has expired is sent once more with the credentials.
+    authRoundTrips counts the requests that carried credentials.
+
+    A plain GET (no body, sink, progress callbacks or own timeouts) that is
+    identical to one already in flight is not sent again but coalesced with
+    it and gets the same response; coalesced counts the requests saved.
+
     Parameters
     ----------
     debug : bool
@@ -117,45 +752,222 @@ class NetworkAccessManager():
             # Handle exception
             pass
 
+        pending = [nam.requestAsync(url) for url in urls]
+        nam.waitForAll(pending)
+        for p in pending:
+            (response, content) = p.result()
+
 
     """
 
 
-    def __init__(self, authid=None, disable_ssl_certificate_validation=False, exception_class=None, debug=True):
+    def __init__(self, authid=None, disable_ssl_certificate_validation=False, exception_class=None, debug=True, manager=None):
         self.disable_ssl_certificate_validation = disable_ssl_certificate_validation
+        self.manager = manager
         self.authid = authid
-        self.reply = None
         self.debug = debug
         self.exception_class = exception_class
         self.cookie = None
         self.basicauth = None
+        self.user = None
+        # the ETag / Last-Modified validators of GET responses, by url
+        self.validators = {}
+        self.cache = None
+        self.retryPolicy = RetryPolicy()
+        self.timeouts = Timeouts()
+        # one CircuitBreaker per host
+        self.circuitBreakers = {}
+        # the GETs in flight other requests can be coalesced with, by key
+        self.inflight = {}
+        self.coalesced = 0
+        self.session = False
+        # the url below which session cookies are accepted, see
+        # setSessionMode()
+        self.sessionScope = None
+        # the cookies set by the server in session mode, by name
+        self.sessionCookies = {}
+        self.authRoundTrips = 0
+        self.reauthentications = 0
 
-    def setBasicauth(self, encodedString):
+    def setBasicauth(self, encodedString, user = None):
+        # user names the owner of the credentials in cache keys, see
+        # cacheIdentity()
         self.basicauth = encodedString
+        self.user = user
+        # a session belongs to the user it was created for
+        self.sessionCookies = {}
+
+    def setSessionMode(self, enabled = True, scope = None):
+        # with a scope only the cookies of responses from that host, below
+        # its path, are kept
+        self.session = enabled
+        self.sessionScope = scope
+        if not enabled:
+            self.sessionCookies = {}
 
     def setCookie(self, cookie):
         self.cookie = cookie
 
+    def setCache(self, cache):
+        self.cache = cache
+
+    def networkManager(self):
+        if self.manager is not None:
+            return self.manager
+        return QgsNetworkAccessManager.instance()
+
+    def setTimeouts(self, timeouts):
+        # the default Timeouts for requests sent without their own
+        self.timeouts = timeouts
+
+    def setRetryPolicy(self, retryPolicy):
+        # None disables retries
+        self.retryPolicy = retryPolicy
+
+    def circuitBreaker(self, url):
+        parts = urlsplit(url)
+        host = parts.scheme + '://' + parts.netloc
+        if host not in self.circuitBreakers:
+            self.circuitBreakers[host] = CircuitBreaker()
+        return self.circuitBreakers[host]
+
+    def cacheIdentity(self, authenticate):
+        # responses are cached per user, so that they are never served to
+        # somebody with different permissions. The identity ends up in
+        # persisted cache keys, so it never contains the credentials, only
+        # a keyed hash of them that is valid for this session if the user
+        # is not known
+        identity = self.authid or ''
+        if self.basicauth is not None and authenticate:
+            if self.user is not None:
+                identity += '\nuser:' + self.user
+            else:
+                basicauth = self.basicauth
+                if PYTHON_VERSION >= 3 and not isinstance(basicauth, bytes):
+                    basicauth = basicauth.encode('utf-8')
+                identity += '\ncredentials:' + hmac.new(IDENTITY_KEY,
+                    basicauth, hashlib.sha256).hexdigest()
+        return identity
+
+    def coalesceKey(self, pending, body, headers, authenticate, conditional):
+        if pending.method != 'GET' or body is not None:
+            return None
+        if pending.sink is not None or pending.progress is not None:
+            return None
+        if pending.uploadProgress is not None or pending.timeouts is not self.timeouts:
+            return None
+        headerItems = tuple(sorted((headers or {}).items()))
+        return (pending.url, self.cacheIdentity(authenticate), conditional, headerItems)
+
     def msg_log(self, msg):
         if self.debug:
             QgsMessageLog.logMessage(msg, "NetworkAccessManager")
 
-    def request(self, url, method="GET", body=None, headers=None, redirections=DEFAULT_MAX_REDIRECTS, connection_type=None, authenticate = True):
+    def request(self, url, method="GET", body=None, headers=None, redirections=DEFAULT_MAX_REDIRECTS, connection_type=None, authenticate = True, conditional = False, useCache = True, sink = None, progress = None, uploadProgress = None, timeouts = None):
         """
         Make a network request by calling QgsNetworkAccessManager.
         redirections argument is ignored and is here only for httplib2 compatibility.
         """
+        pending = self.requestAsync(url, method, body, headers,
+                                    authenticate = authenticate,
+                                    conditional = conditional,
+                                    useCache = useCache,
+                                    sink = sink,
+                                    progress = progress,
+                                    uploadProgress = uploadProgress,
+                                    timeouts = timeouts)
+        return pending.result()
+
+    def requestAsync(self, url, method="GET", body=None, headers=None, callback=None, authenticate = True, conditional = False, useCache = True, sink = None, progress = None, uploadProgress = None, timeouts = None):
+        """
+        Send a network request without blocking and return a PendingRequest.
+        If given, callback is called with the PendingRequest when it finished.
+        With conditional = True a GET is sent with the validators of the last
+        response for the same url, the response then has notModified set if
+        the server answered with 304 Not Modified.
+        With a sink (a file path or an object with a write() method) the body
+        is streamed to it instead of being read into the response.
+        progress and uploadProgress are called with the TransferStats of the
+        download and the upload. timeouts overrides the default Timeouts.
+        """
         self.msg_log(u'http_call request: {0}'.format(url))
-        self.http_call_result = Response({
-            'status': 0,
-            'status_code': 0,
-            'status_message': '',
-            'text' : '',
-            'ok': False,
-            'headers': {},
-            'reason': '',
-            'exception': None,
-        })
+        pending = PendingRequest(self, url, method, sink, progress,
+                                 uploadProgress, timeouts)
+        pending.authenticate = authenticate
+        if callback is not None:
+            pending.addCallback(callback)
+        if self.cache is not None:
+            if pending.method == 'GET' and useCache:
+                pending.cacheKey = self.cache.key(pending.method, url,
+                    self.cacheIdentity(authenticate))
+                cached = self.cache.get(pending.cacheKey)
+                if cached is not None:
+                    self.msg_log("Serving %s from the response cache" % url)
+                    self.fillResponseFromCache(pending, cached, conditional)
+                    pending.done()
+                    return pending
+            elif pending.method not in ['GET', 'HEAD']:
+                parts = urlsplit(url)
+                self.cache.invalidate(parts.scheme + '://' + parts.netloc)
+        key = self.coalesceKey(pending, body, headers, authenticate, conditional)
+        if key is not None:
+            if key in self.inflight:
+                self.coalesced += 1
+                self.msg_log("Coalescing %s with the request in flight" % url)
+                pending.follow(self.inflight[key])
+                return pending
+            pending.coalesceKey = key
+            self.inflight[key] = pending
+        if not self.circuitBreaker(url).allowRequest():
+            msg = "Circuit open: {0} failed repeatedly, not sending {1}".format(
+                urlsplit(url).netloc, url)
+            self.msg_log(msg)
+            pending.http_call_result.reason = msg
+            pending.http_call_result.exception = RequestsExceptionCircuitOpen(msg)
+            pending.done()
+            return pending
+        if conditional and pending.method == 'GET' and url in self.validators:
+            headers = dict(headers) if headers is not None else {}
+            validators = self.validators[url]
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last-modified' in validators:
+                headers['If-Modified-Since'] = validators['last-modified']
+        else:
+            conditional = False
+        # a QHttpMultiPart cannot be sent again after a 401, see reauthenticate()
+        resendable = body is None or isinstance(body, (bytes, type(u'')))
+        req = self.createRequest(url, headers, authenticate, resendable)
+        if conditional:
+            # bypass the QGIS network cache, otherwise Qt answers a 304 with
+            # the cached entity itself
+            req.setAttribute(QNetworkRequest.CacheLoadControlAttribute, QNetworkRequest.AlwaysNetwork)
+            req.setAttribute(QNetworkRequest.CacheSaveControlAttribute, False)
+        self.sendRequest(pending, req, body)
+        return pending
+
+    def storeValidators(self, url, result):
+        validators = validatorsOf(result.headers)
+        if len(validators) > 0:
+            self.validators[url] = validators
+        else:
+            self.validators.pop(url, None)
+
+    def waitForAll(self, pendingRequests):
+        """Block in one local event loop until all given requests have finished"""
+        remaining = [p for p in pendingRequests if not p.isFinished()]
+        if len(remaining) == 0:
+            return
+        el = QEventLoop()
+        def onFinished(pending):
+            remaining.remove(pending)
+            if len(remaining) == 0:
+                el.quit()
+        for pending in list(remaining):
+            pending.addCallback(onFinished)
+        el.exec_()
+
+    def createRequest(self, url, headers=None, authenticate=True, resendable=True):
         req = QNetworkRequest()
         req.setAttribute(QNetworkRequest.CookieSaveControlAttribute, QNetworkRequest.Manual)
         req.setAttribute(QNetworkRequest.CookieLoadControlAttribute, QNetworkRequest.Manual)
@@ -165,143 +977,292 @@ class NetworkAccessManager():
         else:
             url = urllib2.unquote(url)
         req.setUrl(QUrl(url))
+        # HTTP/2 is only available since Qt 5.8
+        if self.manager is not None and hasattr(QNetworkRequest, 'HTTP2AllowedAttribute'):
+            req.setAttribute(QNetworkRequest.HTTP2AllowedAttribute, True)
+
+        # copy the headers so that the caller's dict is not modified
+        headers = dict(headers) if headers is not None else {}
 
+        cookies = []
         if self.cookie is not None:
-            if headers is not None:
-                headers['Cookie'] = self.cookie
-            else:
-                headers = {'Cookie':self.cookie}
+            cookies.append(self.cookie)
 
         if self.basicauth is not None and authenticate:
-            if headers is not None:
-                headers['Authorization'] = self.basicauth
+            # a body that cannot be sent again always carries the
+            # credentials, the session might expire meanwhile
+            if self.session and len(self.sessionCookies) > 0 and resendable:
+                cookies.append(self.sessionCookieHeader())
             else:
-                headers = {'Authorization':self.basicauth}
-
-        if headers is not None:
-            # This fixes a wierd error with compressed content not being correctly
-            # inflated.
-            # If you set the header on the QNetworkRequest you are basically telling
-            # QNetworkAccessManager "I know what I'm doing, please don't do any content
-            # encoding processing".
-            # See: https://bugs.webkit.org/show_bug.cgi?id=63696#c1
-            try:
-                del headers['Accept-Encoding']
-            except KeyError:
-                pass
-            for k, v in headers.items():
-                if PYTHON_VERSION >= 3:
-                    if isinstance(k, str):
-                        k = k.encode('utf-8')
-                    if isinstance(v, str):
-                        v = v.encode('utf-8')
-                req.setRawHeader(k, v)
+                headers['Authorization'] = self.basicauth
+                self.authRoundTrips += 1
+
+        if len(cookies) > 0:
+            headers['Cookie'] = '; '.join(cookies)
+
+        # This fixes a wierd error with compressed content not being correctly
+        # inflated.
+        # If you set the header on the QNetworkRequest you are basically telling
+        # QNetworkAccessManager "I know what I'm doing, please don't do any content
+        # encoding processing".
+        # See: https://bugs.webkit.org/show_bug.cgi?id=63696#c1
+        # Qt adds the header itself and inflates the body
+        for name in list(headers.keys()):
+            if name.lower() == 'accept-encoding':
+                del headers[name]
+        for k, v in headers.items():
+            if PYTHON_VERSION >= 3:
+                if isinstance(k, str):
+                    k = k.encode('utf-8')
+                if isinstance(v, str):
+                    v = v.encode('utf-8')
+            req.setRawHeader(k, v)
 
         if self.authid:
             self.msg_log("Update request w/ authid: {0}".format(self.authid))
             QgsAuthManager.instance().updateNetworkRequest(req, self.authid)
-        if self.reply is not None and self.reply.isRunning():
-            self.reply.close()
+        return req
+
+    def sendRequest(self, pending, req, body=None):
+        if PYTHON_VERSION >= 3:
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+        pending.req = req
+        pending.body = body
+        self.dispatch(pending)
+
+    def dispatch(self, pending):
+        req = pending.req
+        body = pending.body
+        method = pending.method
         if method.lower() == 'delete':
-            func = getattr(QgsNetworkAccessManager.instance(), 'deleteResource')
+            func = getattr(self.networkManager(), 'deleteResource')
         else:
-            func = getattr(QgsNetworkAccessManager.instance(), method.lower())
+            func = getattr(self.networkManager(), method.lower())
         # Calling the server ...
         # Let's log the whole call for debugging purposes:
-        self.msg_log("Sending %s request to %s" % (method.upper(), req.url().toString()))
+        self.msg_log("Sending %s request to %s" % (method, req.url().toString()))
         headers = {str(h): str(req.rawHeader(h)) for h in req.rawHeaderList()}
         for k, v in headers.items():
             self.msg_log("%s: %s" % (k, v))
         if method.lower() in ['post', 'put']:
-            if PYTHON_VERSION >= 3:
-                if isinstance(body, str):
-                    body = body.encode('utf-8')
-            self.reply = func(req, body)
+            reply = func(req, body)
         else:
-            self.reply = func(req)
+            reply = func(req)
         if self.authid:
             self.msg_log("Update reply w/ authid: {0}".format(self.authid))
-            QgsAuthManager.instance().updateNetworkReply(self.reply, self.authid)
+            QgsAuthManager.instance().updateNetworkReply(reply, self.authid)
+        pending.setReply(reply)
 
-        self.reply.sslErrors.connect(self.sslErrors)
-        self.reply.finished.connect(self.replyFinished)
+    def retryLater(self, pending):
+        """
+        Record the outcome of a finished reply in the host's circuit breaker
+        and schedule a retry if the retry policy allows one
+        """
+        result = pending.http_call_result
+        error = pending.reply.error()
+        status = result.status or 0
+        breaker = self.circuitBreaker(pending.url)
+        if pending.timeoutPhase in ['firstByte', 'total']:
+            # a slow endpoint is not a sign that the host is down, and
+            # asking it again would only be slow again
+            breaker.releaseTrial()
+            return False
+        if pending.timeoutPhase is not None:
+            error = QNetworkReply.TimeoutError
+        if self.retryPolicy is not None:
+            transient = self.retryPolicy.retryStatus
+        else:
+            transient = TRANSIENT_STATUS
+        # any other answer, e.g. a 500 of one broken endpoint, shows that
+        # the host itself is up
+        if status in transient or (status == 0 and error != QNetworkReply.NoError):
+            breaker.recordFailure()
+        else:
+            breaker.recordSuccess()
+            return False
+        if self.retryPolicy is None:
+            return False
+        if not pending.canResend():
+            return False
+        if not self.retryPolicy.shouldRetry(pending.method, pending.attempt, status, error):
+            return False
+        if not breaker.allowRequest():
+            return False
+        delay = self.retryPolicy.delay(pending.attempt, result.headers.get('retry-after'))
+        self.msg_log("Retrying %s %s in %.1f s (%s)" % (pending.method,
+            pending.url, delay, result.reason))
+        QTimer.singleShot(int(delay * 1000), pending.resend)
+        return True
 
-        # Call and block
-        self.el = QEventLoop()
-        self.reply.finished.connect(self.el.quit)
-        self.reply.downloadProgress.connect(self.downloadProgress)
+    def sessionCookieHeader(self):
+        return '; '.join(['%s=%s' % (name, value)
+                          for name, value in self.sessionCookies.items()])
 
-        # Catch all exceptions (and clean up requests)
-        try:
-            self.el.exec_()
-            # Let's log the whole response for debugging purposes:
-            self.msg_log("Got response %s %s from %s" % \
-                        (self.http_call_result.status_code,
-                         self.http_call_result.status_message,
-                         self.reply.url().toString()))
-            headers = {str(h): str(self.reply.rawHeader(h)) for h in self.reply.rawHeaderList()}
-            for k, v in headers.items():
-                self.msg_log("%s: %s" % (k, v))
-            if len(self.http_call_result.text) < 1024:
-                self.msg_log("Payload :\n%s" % self.http_call_result.text)
-            else:
-                self.msg_log("Payload is > 1 KB ...")
-        except Exception as e:
-            raise e
-        finally:
-            if self.reply is not None:
-                if self.reply.isRunning():
-                    self.reply.close()
-                self.msg_log("Deleting reply ...")
-                self.reply.deleteLater()
-                self.reply = None
-            else:
-                self.msg_log("Reply was already deleted ...")
-        if not self.http_call_result.ok:
-            if self.http_call_result.exception and not self.exception_class:
-                raise self.http_call_result.exception
+    def updateSession(self, pending):
+        """
+        Keep the cookies a response sets in session mode. Only responses to
+        requests that were sent with the credentials or the session cookie
+        to the session scope can open or change the session
+        """
+        if not self.session or not pending.authenticate or self.basicauth is None:
+            return
+        setCookie = pending.http_call_result.headers.get('set-cookie')
+        if not setCookie:
+            return
+        parts = urlsplit(pending.url)
+        path = parts.path or '/'
+        if self.sessionScope is not None:
+            scope = urlsplit(self.sessionScope)
+            if parts.netloc.lower() != scope.netloc.lower():
+                return
+            if not pathMatches(path, scope.path or '/'):
+                return
+            # the cookies are sent to every url of the scope
+            path = scope.path or '/'
+        # Qt joins several Set-Cookie headers with newlines
+        for line in setCookie.split('\n'):
+            attributes = line.split(';')
+            pair = attributes[0].strip()
+            if '=' not in pair:
+                continue
+            cookiePath = None
+            for attribute in attributes[1:]:
+                key, _, value = attribute.partition('=')
+                if key.strip().lower() == 'path':
+                    cookiePath = value.strip()
+            if cookiePath and not pathMatches(path, cookiePath):
+                continue
+            name, value = pair.split('=', 1)
+            if value.strip() == '':
+                self.sessionCookies.pop(name.strip(), None)
             else:
-                raise self.exception_class(self.http_call_result.reason)
-        return (self.http_call_result, self.http_call_result.text)
+                self.sessionCookies[name.strip()] = value.strip()
+
+    def reauthenticate(self, pending):
+        """
+        Send a request that was rejected with 401 Unauthorized once more with
+        the credentials if it was only sent with the session cookie
+        """
+        req = pending.req
+        if not self.session or not pending.authenticate or self.basicauth is None:
+            return False
+        if pending.http_call_result.status != 401 or req.hasRawHeader(b'Authorization'):
+            return False
+        # neither a QHttpMultiPart nor a body already written to a caller's
+        # sink can be sent or taken back again
+        if pending.body is not None and not isinstance(pending.body, bytes):
+            return False
+        if not pending.canResend():
+            return False
+        self.msg_log("Session expired, authenticating %s again" % pending.url)
+        self.sessionCookies = {}
+        self.reauthentications += 1
+        self.authRoundTrips += 1
+        basicauth = self.basicauth
+        cookie = self.cookie or ''
+        if PYTHON_VERSION >= 3:
+            if isinstance(basicauth, str):
+                basicauth = basicauth.encode('utf-8')
+            cookie = cookie.encode('utf-8')
+        req.setRawHeader(b'Authorization', basicauth)
+        # an empty value removes the header
+        req.setRawHeader(b'Cookie', cookie)
+        QTimer.singleShot(0, pending.resend)
+        return True
+
+    def logResponse(self, reply, result):
+        # Let's log the whole response for debugging purposes:
+        if not self.debug:
+            return
+        self.msg_log("Got response %s %s from %s" % \
+                    (result.status_code,
+                     result.status_message,
+                     reply.url().toString()))
+        headers = {str(h): str(reply.rawHeader(h)) for h in reply.rawHeaderList()}
+        for k, v in headers.items():
+            self.msg_log("%s: %s" % (k, v))
+        if len(result.text) < 1024:
+            self.msg_log("Payload :\n%s" % result.text)
+        else:
+            self.msg_log("Payload is > 1 KB ...")
 
     #@pyqtSlot()
-    def downloadProgress(self, bytesReceived, bytesTotal):
+    def downloadProgress(self, pending, bytesReceived, bytesTotal):
         """Keep track of the download progress"""
-        #self.msg_log("downloadProgress %s of %s ..." % (bytesReceived, bytesTotal))
-        pass
+        pending.downloadStats.update(bytesReceived, bytesTotal)
+        #self.msg_log("downloadProgress %s ..." % pending.downloadStats)
+        if pending.progress is not None:
+            pending.progress(pending.downloadStats)
 
     #@pyqtSlot()
-    def replyFinished(self):
-        err = self.reply.error()
-        httpStatus = self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
-        httpStatusMessage = self.reply.attribute(QNetworkRequest.HttpReasonPhraseAttribute)
-        self.http_call_result.status_code = httpStatus
-        self.http_call_result.status = httpStatus
-        self.http_call_result.status_message = httpStatusMessage
-        for k, v in self.reply.rawHeaderPairs():
-            self.http_call_result.headers[str(k)] = str(v)
-            self.http_call_result.headers[str(k).lower()] = str(v)
+    def uploadProgress(self, pending, bytesSent, bytesTotal):
+        """Keep track of the upload progress"""
+        pending.uploadStats.update(bytesSent, bytesTotal)
+        if pending.uploadProgress is not None:
+            pending.uploadProgress(pending.uploadStats)
+
+    def fillResponse(self, reply, result, readBody = True):
+        """Copy status, headers and body of a finished reply into result"""
+        err = reply.error()
+        httpStatus = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        httpStatusMessage = reply.attribute(QNetworkRequest.HttpReasonPhraseAttribute)
+        result.status = httpStatus
+        result.status_message = httpStatusMessage
+        result.notModified = httpStatus == 304
+        result.setRawHeaders(reply.rawHeaderPairs())
         if err != QNetworkReply.NoError:
             msg = "Network error #{0}: {1}".format(
-                self.reply.error(), self.reply.errorString())
-            self.http_call_result.reason = msg
-            self.http_call_result.ok = False
+                reply.error(), reply.errorString())
+            result.reason = msg
+            result.ok = False
             self.msg_log(msg)
             if err == QNetworkReply.TimeoutError:
-                self.http_call_result.exception = RequestsExceptionTimeout(msg)
+                result.exception = RequestsExceptionTimeout(msg)
             elif err == QNetworkReply.ConnectionRefusedError:
-                self.http_call_result.exception = RequestsExceptionConnectionError(msg)
+                result.exception = RequestsExceptionConnectionError(msg)
             else:
-                self.http_call_result.exception = RequestsException(msg)
+                result.exception = RequestsException(msg)
         else:
             # since Python 3 readAll() returns a PyQt5.QByteArray, we
             # want only the data
-            if PYTHON_VERSION >= 3:
-                self.http_call_result.text = self.reply.readAll().data().decode('utf-8')
-            else:
-                self.http_call_result.text = str(self.reply.readAll())
-            self.http_call_result.ok = True
-        self.reply.deleteLater()
+            if readBody:
+                if PYTHON_VERSION >= 3:
+                    data = reply.readAll().data()
+                else:
+                    data = str(reply.readAll())
+                self.setBody(result, data)
+            result.ok = True
+
+    def setBody(self, result, data):
+        result.setContent(data)
+        result.bytesReceived = len(data)
+
+    def fillResponseFromCache(self, pending, cached, conditional):
+        result = pending.http_call_result
+        url = pending.url
+        entry, path = cached
+        result.status = entry['status']
+        result.status_message = 'OK'
+        result.headers = dict(entry['headers'])
+        result.ok = True
+        result.fromCache = True
+        # a conditional request is answered as not modified if the cached
+        # entity is the one the caller has already received
+        validators = validatorsOf(result.headers)
+        if conditional and len(validators) > 0 and self.validators.get(url) == validators:
+            result.notModified = True
+        elif pending.sinkPath is not None:
+            pending.sink.close()
+            shutil.copyfile(path, pending.sinkPath)
+            result.bytesReceived = entry['size']
+        else:
+            with open(path, 'rb') as file:
+                if pending.sink is not None:
+                    shutil.copyfileobj(file, pending.sink)
+                    result.bytesReceived = entry['size']
+                else:
+                    self.setBody(result, file.read())
 
     #@pyqtSlot()
     def sslErrors(self, reply, ssl_errors):
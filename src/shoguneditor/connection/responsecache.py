@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+from collections import OrderedDict
+
+if sys.version_info[0] >= 3:
+    from qgis.PyQt.QtCore import QTimer
+else:
+    from PyQt4.QtCore import QTimer
+
+from qgis.core import QgsApplication
+
+
+class ResponseCache():
+    ''' A persistent cache for the bodies of GET responses, stored as one file
+    per entry in a directory under the QGIS profile. Entries are keyed by
+    method, url and the identity of the authenticated user and expire after a
+    time to live chosen by the first pattern of ttls contained in the url.
+    If the size of all entries exceeds maxSize, the least recently used
+    entries are evicted.
+
+    Headers that carry credentials or session cookies are not stored. The
+    index is written saveDelay seconds after a change, so that a burst of
+    responses is saved once, and on flush()'''
+
+    # the layout of index.json, an index of another format is discarded
+    # together with its entries
+    FORMAT = 2
+
+    # response headers that are never written to disk
+    PRIVATE_HEADERS = ['set-cookie', 'set-cookie2', 'authorization',
+        'proxy-authorization', 'www-authenticate', 'proxy-authenticate']
+
+    # (url pattern, time to live in seconds), the first matching pattern wins
+    DEFAULT_TTLS = [
+        ('request=GetStyles', 3600),
+        ('request=DescribeFeatureType', 3600),
+        ('getThumbnail.action', 86400),
+        ('rest/entitypermission', 60),
+        ('rest/', 60)
+        ]
+
+    def __init__(self, directory, maxSize = 50 * 1024 * 1024, ttls = None, defaultTtl = 0, saveDelay = 5):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.indexPath = os.path.join(self.directory, 'index.json')
+        self.maxSize = maxSize
+        self.ttls = ttls if ttls is not None else self.DEFAULT_TTLS
+        self.defaultTtl = defaultTtl
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        # key -> entry dict, ordered from least to most recently used
+        self.index = OrderedDict()
+        self.dirty = False
+        self.saveTimer = QTimer()
+        self.saveTimer.setSingleShot(True)
+        self.saveTimer.setInterval(int(saveDelay * 1000))
+        self.saveTimer.timeout.connect(self.flush)
+        self.loadIndex()
+
+    @staticmethod
+    def key(method, url, identity = None):
+        text = '\n'.join([method.upper(), url, identity or ''])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def ttlFor(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern in url:
+                return ttl
+        return self.defaultTtl
+
+    def loadIndex(self):
+        try:
+            with open(self.indexPath, 'r') as file:
+                index = json.load(file)
+        except (IOError, OSError, ValueError):
+            index = {}
+        if index.get('format') == self.FORMAT:
+            entries = index['entries']
+        else:
+            # older indexes keyed entries by a hash of the credentials
+            self.removeAll()
+            entries = {}
+            self.dirty = True
+        now = time.time()
+        for key, entry in sorted(entries.items(), key = lambda x: x[1]['accessed']):
+            if entry['expires'] > now and os.path.isfile(self.entryPath(key)):
+                # an index written by an older version may hold cookies
+                if self.privateHeaders(entry['headers']):
+                    entry['headers'] = self.publicHeaders(entry['headers'])
+                    self.dirty = True
+                self.index[key] = entry
+                self.size += entry['size']
+            else:
+                self.removeFile(key)
+                self.dirty = True
+        if self.dirty:
+            self.flush()
+
+    def privateHeaders(self, headers):
+        return [name for name in headers if name.lower() in self.PRIVATE_HEADERS]
+
+    def publicHeaders(self, headers):
+        return {name: value for name, value in headers.items()
+                if name.lower() not in self.PRIVATE_HEADERS}
+
+    def saveIndex(self):
+        # the index is written later, see flush()
+        self.dirty = True
+        if not self.saveTimer.isActive():
+            self.saveTimer.start()
+
+    def flush(self):
+        self.saveTimer.stop()
+        if not self.dirty:
+            return
+        try:
+            with open(self.indexPath, 'w') as file:
+                json.dump({'format': self.FORMAT, 'entries': self.index}, file)
+            self.dirty = False
+        except (IOError, OSError):
+            pass
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, key)
+
+    def removeAll(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path != self.indexPath and os.path.isfile(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def removeFile(self, key):
+        try:
+            os.remove(self.entryPath(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        ''' Returns the cached entry dict (with 'url', 'status', 'headers') and
+        the path of the file holding the body, or None if there is no fresh
+        entry for key'''
+        if not self.enabled:
+            return None
+        entry = self.index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        path = self.entryPath(key)
+        if entry['expires'] <= time.time() or not os.path.isfile(path):
+            self.remove(key)
+            self.misses += 1
+            return None
+        # mark as most recently used
+        del self.index[key]
+        entry['accessed'] = time.time()
+        self.index[key] = entry
+        self.hits += 1
+        return entry, path
+
+    def put(self, key, url, status, headers, body = None, path = None):
+        ''' Stores a response body, given either as bytes or as the path of
+        a file it has been streamed to'''
+        if not self.enabled:
+            return False
+        ttl = self.ttlFor(url)
+        if ttl <= 0:
+            return False
+        self.remove(key, save = False)
+        try:
+            if path is not None:
+                size = os.path.getsize(path)
+                if size > self.maxSize:
+                    return False
+                shutil.copyfile(path, self.entryPath(key))
+            else:
+                size = len(body)
+                if size > self.maxSize:
+                    return False
+                with open(self.entryPath(key), 'wb') as file:
+                    file.write(body)
+        except (IOError, OSError):
+            return False
+        now = time.time()
+        self.index[key] = {
+            'url' : url,
+            'status' : status,
+            'headers' : self.publicHeaders(headers),
+            'size' : size,
+            'expires' : now + ttl,
+            'accessed' : now
+            }
+        self.size += size
+        self.evict()
+        self.saveIndex()
+        return True
+
+    def remove(self, key, save = True):
+        entry = self.index.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry['size']
+        self.removeFile(key)
+        if save:
+            self.saveIndex()
+
+    def evict(self):
+        while self.size > self.maxSize and len(self.index) > 0:
+            key = next(iter(self.index))
+            self.remove(key, save = False)
+            self.evictions += 1
+
+    def invalidate(self, urlPrefix = None):
+        ''' Removes all entries whose url starts with urlPrefix, or all entries
+        if no prefix is given'''
+        keys = [key for key, entry in self.index.items()
+            if urlPrefix is None or entry['url'].startswith(urlPrefix)]
+        for key in keys:
+            self.remove(key, save = False)
+        if len(keys) > 0:
+            self.saveIndex()
+
+    def stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'entries' : len(self.index),
+            'size' : self.size,
+            'maxSize' : self.maxSize
+            }
+
+
+_sharedCache = None
+
+def sharedResponseCache():
+    ''' Returns the response cache shared by all Shogun connections, located
+    in the active QGIS profile directory'''
+    global _sharedCache
+    if _sharedCache is None:
+        directory = os.path.join(QgsApplication.qgisSettingsDirPath(),
+            'shoguneditor', 'cache')
+        _sharedCache = ResponseCache(directory)
+    return _sharedCache
+
+def flushSharedResponseCache():
+    ''' Writes the index of the shared response cache if it has changed'''
+    if _sharedCache is not None:
+        _sharedCache.flush()
@@ -12,6 +12,8 @@ from base64 import b64encode
 import urllib
 import json
 import os
+import tempfile
+import sqlite3
 import webbrowser
 
 if sys.version_info[0] >= 3:
@@ -29,6 +31,12 @@ from qgis.core import QgsApplication
 from qgis.gui import QgsMessageBar
 
 from .networkaccessmanager import NetworkAccessManager, RequestsExceptionConnectionError, RequestsException
+from .networkaccessmanager import Timeouts, createNetworkManager
+from .catalog import CatalogStore
+from .jsonstream import JsonArrayStream
+from .responsecache import sharedResponseCache
+from .snapshot import snapshotFor
+from .layerindex import LayerIndex, applicationLayerIds
 from shoguneditor.layerutils import createAndParseSld
 
 
@@ -40,6 +48,29 @@ class ShogunRessource:
     class NetworkAccessManager, which calls QgsNetworkAccessManager for all http
     requests'''
 
+    # the catalog collections fetched by updateData() and the attribute each
+    # one is stored in
+    CATALOG_ENDPOINTS = [
+        ('rest/applications', 'applications'),
+        ('rest/layers', 'layers'),
+        ('rest/extents', 'extents'),
+        ('rest/mapconfigs', 'mapconfigs')
+        ]
+
+    # the large collections, which are parsed while they arrive instead of
+    # being read into memory as a whole
+    STREAMED_ENDPOINTS = ['rest/applications', 'rest/layers']
+
+    # the fields of the applications and layers the tree needs, only these
+    # are kept of the whole collections. The complete entity is fetched
+    # when it is needed, see getApplicationAttrsById(). The summary of an
+    # application also has the ids of all layers in its tree as 'layerIds'
+    APPLICATION_SUMMARY = ['id', 'name', 'modified']
+    LAYER_SUMMARY = ['id', 'name', 'dataType', 'source', 'modified']
+
+    # the permissions kept for every application and layer
+    PERMISSION_TYPES = ['User', 'UserGroup']
+
     def __init__(self, iface, url, name, user = None, pw = None):
         self.iface = iface
         if url.endswith('webapp'):
@@ -51,11 +82,31 @@ class ShogunRessource:
 
         self.baseurl = url      #url should have the format: 'https:.../shogun2-webapp/'
         self.name = name
-        self.applications = []
-        self.layers = []
-        self.mapconfigs = []
-        self.extents = []
-        self.http = NetworkAccessManager(debug = False)
+        self.applications = CatalogStore(summaryFields = self.APPLICATION_SUMMARY,
+            derive = lambda app: {'layerIds': applicationLayerIds(app)})
+        self.layers = CatalogStore(summaryFields = self.LAYER_SUMMARY)
+        self.mapconfigs = CatalogStore()
+        self.extents = CatalogStore()
+        self.updateErrors = {}
+        self.currentUpload = None
+        # the User and UserGroup permissions by (objectType, id), and how
+        # often they have been invalidated
+        self.permissions = {}
+        self.permissionGenerations = {}
+        # increased whenever all cached permissions are dropped
+        self.permissionsCleared = 0
+        self.snapshot = None
+        # which applications use a layer
+        self.layerIndex = LayerIndex(self.applications)
+        # every connection has its own network manager, see
+        # createNetworkManager()
+        self.http = NetworkAccessManager(debug = False,
+            manager = createNetworkManager())
+        self.http.setCache(sharedResponseCache())
+        # the credentials are only sent until SHOGun has opened a session,
+        # so that Spring Security does not check them on every request. Only
+        # SHOGun itself can open the session, not e.g. the GeoServer
+        self.http.setSessionMode(scope = self.baseurl)
 
         self.icondir =  os.path.join(os.path.dirname(__file__), '..', 'images', 'custom-symbols')
         if not os.path.isdir(self.icondir):
@@ -66,10 +117,10 @@ class ShogunRessource:
             if PYTHON_VERSION >= 3:
                 bytes = (user + ':' + pw).encode('utf-8')
                 self.basicauth = b64encode(bytes)
-                self.http.setBasicauth('Basic '.encode('utf-8') + self.basicauth)
+                self.http.setBasicauth('Basic '.encode('utf-8') + self.basicauth, user)
             else:
                 self.basicauth = b64encode(user + ':' + pw)
-                self.http.setBasicauth('Basic ' + self.basicauth)
+                self.http.setBasicauth('Basic ' + self.basicauth, user)
 
 
     def checkConnection(self):
@@ -142,11 +193,6 @@ class ShogunRessource:
 
 
     def editMapConfig(self, id, data):
-        edit = None
-        for mapconfig in self.mapconfigs:
-            if mapconfig['id'] == id:
-                edit = mapconfig
-
         url = self.baseurl+'mapconfigs/'+str(id)
         body = '{"id":'+str(id)+',"center":{"x":'+str(data['center']['x'])+',"y":'
         body += str(data['center']['y'])+'},"zoom":'+str(data['zoom'])+'}'
@@ -162,102 +208,337 @@ class ShogunRessource:
             url += '/ProjectUserGroup'
         else:
             return
+        # objectType = 'ProjectApplication' or 'ProjectLayer'
+        entityType = objectType[len('Project'):]
+        self.invalidatePermissions(id, entityType)
 
         header = {'Content-type' : 'application/json'}
         body = json.dumps(data)
-        response = self.http.request(url, method='POST', body = body, headers = header)
+        try:
+            response = self.http.request(url, method='POST', body = body, headers = header)
+        finally:
+            # permissions requested while the POST was running may have been
+            # answered with the old ones
+            self.invalidatePermissions(id, entityType)
         if response[0]['status'] == 200 or response[0]['status'] == 201:
             return True
         else:
             return False
 
-    def updateData(self):
-        try:
-            self.updateApplications()
-            self.updateLayers()
-            self.updateExtentsAndMapConfigs()
+    def updateData(self, concurrent = True, useCache = True, onEntity = None):
+        # with concurrent = True all catalog collections are requested at the
+        # same time and each one is processed as soon as it has arrived.
+        # Failures are collected per endpoint in self.updateErrors.
+        # onEntity is called with the attribute name ('applications' or
+        # 'layers') and every entity of the streamed collections as soon as
+        # it has been parsed. Without the cache the permissions are
+        # requested again as well
+        if not useCache:
+            self.clearPermissions()
+        if not concurrent:
+            try:
+                self.updateApplications(useCache, onEntity)
+                self.updateLayers(useCache, onEntity)
+                self.updateExtentsAndMapConfigs(useCache)
+                self.saveSnapshot()
+                return True
+            except RequestsExceptionConnectionError:
+                self.iface.messageBar().pushCritical('Connection Error:',
+                'Could not connect to given SHOGUN host application - Please review url')
+                return False
+
+        self.updateErrors = {}
+        pendingRequests = []
+        for endpoint, attr in self.CATALOG_ENDPOINTS:
+            pending = self.requestCatalog(endpoint, attr, useCache,
+                callback = lambda p, e = endpoint, a = attr: self.catalogFetched(p, e, a),
+                onEntity = onEntity)
+            pendingRequests.append(pending)
+        self.http.waitForAll(pendingRequests)
+
+        if len(self.updateErrors) == 0:
+            self.saveSnapshot()
             return True
-        except RequestsExceptionConnectionError:
+        connectionErrors = [e for e in self.updateErrors.values()
+            if isinstance(e, RequestsExceptionConnectionError)]
+        if len(connectionErrors) == len(self.CATALOG_ENDPOINTS):
             self.iface.messageBar().pushCritical('Connection Error:',
             'Could not connect to given SHOGUN host application - Please review url')
+        else:
+            failed = ', '.join(sorted(self.updateErrors.keys()))
+            self.iface.messageBar().pushWarning('Shogun Editor Info:',
+                'Could not retrieve ' + failed + ' from Shogun')
+        return False
+
+    def syncCatalogs(self, callback):
+        # revalidates all catalog collections without blocking, callback is
+        # called with a dict of attribute name -> CatalogDelta of the
+        # collections that have been modified and a dict of the errors by
+        # endpoint as soon as all of them have been processed
+        markers = {attr: getattr(self, attr).markers()
+            for endpoint, attr in self.CATALOG_ENDPOINTS}
+        remaining = [endpoint for endpoint, attr in self.CATALOG_ENDPOINTS]
+        deltas = {}
+        errors = {}
+        def fetched(pending, endpoint, attr):
+            try:
+                if self.storeCatalog(pending, attr):
+                    deltas[attr] = getattr(self, attr).diff(markers[attr])
+            except (RequestsException, ValueError) as e:
+                errors[endpoint] = e
+            remaining.remove(endpoint)
+            if len(remaining) > 0:
+                return
+            if len(errors) == 0 and len(deltas) > 0:
+                self.saveSnapshot()
+            callback(deltas, errors)
+        for endpoint, attr in self.CATALOG_ENDPOINTS:
+            # the response cache would answer with what is already known
+            self.requestCatalog(endpoint, attr, useCache = False,
+                callback = lambda p, e = endpoint, a = attr: fetched(p, e, a))
+
+    def catalogStores(self):
+        return {attr: getattr(self, attr) for endpoint, attr in self.CATALOG_ENDPOINTS}
+
+    def openSnapshot(self):
+        # the snapshot belongs to the user of this connection
+        if self.snapshot is None:
+            try:
+                self.snapshot = snapshotFor(self.baseurl, self.http.user)
+            except (sqlite3.Error, OSError):
+                return None
+        return self.snapshot
+
+    def loadSnapshot(self):
+        # fills the catalog collections from the snapshot of the last session,
+        # returns False if there is none. They should be revalidated with
+        # updateData() afterwards, the validators of the catalog urls are
+        # restored as well, so that only what has changed is downloaded
+        snapshot = self.openSnapshot()
+        if snapshot is None:
+            return False
+        try:
+            validators = snapshot.load(self.catalogStores())
+        except (sqlite3.Error, ValueError, KeyError):
+            snapshot.clear()
             return False
+        if validators is None:
+            return False
+        self.http.validators.update(validators)
+        return True
 
-    def updateApplications(self):
-        url = self.baseurl + 'rest/applications'
-        response = self.http.request(url)
-        self.applications = json.loads(response[1])
+    def saveSnapshot(self):
+        snapshot = self.openSnapshot()
+        if snapshot is None:
+            return False
+        urls = [self.baseurl + endpoint for endpoint, attr in self.CATALOG_ENDPOINTS]
+        validators = {url: self.http.validators[url] for url in urls
+            if url in self.http.validators}
+        try:
+            return snapshot.save(self.catalogStores(), validators)
+        except sqlite3.Error:
+            return False
 
-    def updateLayers(self):
-        url = self.baseurl + 'rest/layers'
-        response = self.http.request(url)
-        self.layers = json.loads(response[1])
+    def catalogFetched(self, pending, endpoint, attr):
+        try:
+            self.storeCatalog(pending, attr)
+        except (RequestsException, ValueError) as e:
+            self.updateErrors[endpoint] = e
+
+    def requestCatalog(self, endpoint, attr, useCache = True, callback = None, onEntity = None):
+        # the large collections are parsed while they arrive, so they are
+        # never held in memory as a whole body
+        sink = None
+        if endpoint in self.STREAMED_ENDPOINTS:
+            handle, path = tempfile.mkstemp(suffix = '.json')
+            os.close(handle)
+            entityCallback = None
+            if onEntity is not None:
+                entityCallback = lambda entity: onEntity(attr, entity)
+            sink = JsonArrayStream(entityCallback, path,
+                transform = getattr(self, attr).project)
+        return self.http.requestAsync(self.baseurl + endpoint,
+            callback = callback, conditional = len(getattr(self, attr)) > 0,
+            useCache = useCache, sink = sink)
+
+    def storeCatalog(self, pending, attr):
+        # returns False without parsing anything if the server answered that
+        # the collection has not been modified since it was loaded
+        try:
+            response = pending.result()
+            if response[0]['notModified']:
+                return False
+            if pending.sink is not None:
+                entities = pending.sink.result()
+            else:
+                entities = response.json()
+            getattr(self, attr).replaceAll(entities)
+            return True
+        finally:
+            if pending.sink is not None:
+                pending.sink.close()
+                if os.path.isfile(pending.sink.path):
+                    os.remove(pending.sink.path)
+
+    def updateApplications(self, useCache = True, onEntity = None):
+        pending = self.requestCatalog('rest/applications', 'applications',
+            useCache, onEntity = onEntity)
+        return self.storeCatalog(pending, 'applications')
+
+    def updateLayers(self, useCache = True, onEntity = None):
+        pending = self.requestCatalog('rest/layers', 'layers', useCache,
+            onEntity = onEntity)
+        return self.storeCatalog(pending, 'layers')
 
     def updateSingleApplication(self, id):
         url = self.baseurl + 'rest/applications/' + str(id)
         response = self.http.request(url)
-        updatedApplication = json.loads(response[1])
-        for app in enumerate(self.applications):
-            if app[1]['id'] == id:
-                self.layers[app[0]] = updatedApplication
+        updatedApplication = response.json()
+        self.applications.put(updatedApplication)
         return updatedApplication
 
     def updateSingleLayer(self, id):
         url = self.baseurl + 'rest/layers/' + str(id)
         response = self.http.request(url)
-        updatedLayer = json.loads(response[1])
-        for layer in enumerate(self.layers):
-            if layer[1]['id'] == id:
-                self.layers[layer[0]] = updatedLayer
+        updatedLayer = response.json()
+        self.layers.put(updatedLayer)
         return updatedLayer
 
     #one method for retrieving user and groups permissions (permissionType)
     #for layers or applications (objectType)
     def getObjectPermissions(self, id, objectType, permissionType):
-        url = self.baseurl + 'rest/entitypermission/Project' + objectType
         # objectType = 'Application' or 'Layer'
         # permissionType = 'User' or 'UserGroup'
-        url += '/'+ str(id) + '/Project' + permissionType + '?'
-        response = self.http.request(url)
-        return json.loads(response[1])
+        permissions = self.getPermissions(id, objectType)
+        return permissions[self.PERMISSION_TYPES.index(permissionType)]
+
+    def getPermissions(self, id, objectType):
+        # returns the (User, UserGroup) permissions of an object, from the
+        # permission cache or requested both at the same time
+        pendingRequests = self.requestPermissions(id, objectType)
+        self.http.waitForAll([pending for permissionType, pending in pendingRequests])
+        fetched = {}
+        for permissionType, pending in pendingRequests:
+            # raises the error of a failed request
+            fetched[permissionType] = pending.result().json()
+        cached = self.permissions.get((objectType, id), {})
+        permissions = []
+        for permissionType in self.PERMISSION_TYPES:
+            if permissionType in cached:
+                permissions.append(cached[permissionType])
+            elif permissionType in fetched:
+                permissions.append(fetched[permissionType])
+            else:
+                # invalidated while the other type was requested
+                return self.getPermissions(id, objectType)
+        return tuple(permissions)
+
+    def prefetchPermissions(self, ids, objectType):
+        # requests the permissions of all given objects that are not cached
+        # yet without waiting for them
+        for id in ids:
+            self.requestPermissions(id, objectType)
+
+    def invalidatePermissions(self, id, objectType):
+        key = (objectType, id)
+        self.permissions.pop(key, None)
+        # responses to requests sent before are not cached anymore
+        self.permissionGenerations[key] = self.permissionGenerations.get(key, 0) + 1
+
+    def clearPermissions(self):
+        # drops all cached permissions, e.g. to see changes of other users,
+        # including the responses in the response cache
+        self.permissions = {}
+        self.permissionsCleared += 1
+        if self.http.cache is not None:
+            self.http.cache.invalidate(self.baseurl + 'rest/entitypermission')
+
+    def permissionGeneration(self, key):
+        return (self.permissionsCleared, self.permissionGenerations.get(key, 0))
+
+    def requestPermissions(self, id, objectType):
+        # returns (permission type, PendingRequest) of the types not cached
+        key = (objectType, id)
+        cached = self.permissions.get(key, {})
+        generation = self.permissionGeneration(key)
+        pendingRequests = []
+        for permissionType in self.PERMISSION_TYPES:
+            if permissionType in cached:
+                continue
+            url = self.baseurl + 'rest/entitypermission/Project' + objectType
+            url += '/'+ str(id) + '/Project' + permissionType + '?'
+            pendingRequests.append((permissionType, self.http.requestAsync(url,
+                callback = lambda p, t = permissionType:
+                    self.permissionsFetched(p, key, t, generation))))
+        return pendingRequests
+
+    def permissionsFetched(self, pending, key, permissionType, generation):
+        if self.permissionGeneration(key) != generation:
+            return
+        try:
+            permissions = pending.result().json()
+        except (RequestsException, ValueError):
+            return
+        self.permissions.setdefault(key, {})[permissionType] = permissions
 
 
-    def updateExtentsAndMapConfigs(self):
-        url = self.baseurl + 'rest/extents'
-        response = self.http.request(url)
-        self.extents = json.loads(response[1])
-        url = self.baseurl + 'rest/mapconfigs'
-        response = self.http.request(url)
-        self.mapconfigs = json.loads(response[1])
+    def updateExtentsAndMapConfigs(self, useCache = True):
+        pending = self.requestCatalog('rest/extents', 'extents', useCache)
+        self.storeCatalog(pending, 'extents')
+        pending = self.requestCatalog('rest/mapconfigs', 'mapconfigs', useCache)
+        self.storeCatalog(pending, 'mapconfigs')
 
     def getHomeviewByIds(self, mapconfigid, extentid):
         homeview = {}
-        for mapcf in self.mapconfigs:
-            if mapcf['id'] == mapconfigid:
-                homeview['mapconfig']=mapcf
-        for ext in self.extents:
-            if ext['id'] == extentid:
-                homeview['extent']=ext
+        if mapconfigid in self.mapconfigs:
+            homeview['mapconfig'] = self.mapconfigs.get(mapconfigid)
+        if extentid in self.extents:
+            homeview['extent'] = self.extents.get(extentid)
         return homeview
 
     def getApplicationIdsAndNames(self, reload = False):
         if reload:
-            self.updateApplications()
+            self.updateApplications(useCache = False)
         return [(x['id'], x['name']) for x in self.applications]
 
     def getLayerIdsAndNames(self, reload = False):
         if reload:
-            self.updateLayers()
+            self.updateLayers(useCache = False)
         return [(x['id'], x['name'], x['dataType'], x['source']) for x in self.layers]
 
+    def getApplicationsUsingLayer(self, layerId):
+        # (id, name) of the applications whose layer tree contains the layer
+        return [(id, self.applications.get(id)['name'])
+            for id in self.layerIndex.applicationsUsing(layerId)]
+
+    def getApplicationLayerPaths(self, id):
+        # layer id -> folder path of all layers in the tree of an application
+        layerTree = self.getApplicationAttrsById(id)['layerTree']
+        return self.layerIndex.layerPaths(id, layerTree)
+
+    def getOrphanLayers(self):
+        # (id, name) of the layers no application uses
+        used = self.layerIndex.usedLayerIds()
+        return [(x['id'], x['name']) for x in self.layers if x['id'] not in used]
+
     def getApplicationAttrsById(self, id):
-       for x in self.applications:
-           if x['id'] == id:
-               return x
+        # the complete application, fetched once when it is needed first
+        if id in self.applications and not self.applications.isDetailed(id):
+            return self.updateSingleApplication(id)
+        return self.applications.get(id)
 
     def getLayerAttrsById(self, id):
-        for x in self.layers:
-            if x['id'] == id:
-                return x
+        if id in self.layers and not self.layers.isDetailed(id):
+            return self.updateSingleLayer(id)
+        return self.layers.get(id)
+
+    def cacheStats(self):
+        # hit, miss and eviction counters of the response cache, the number
+        # of requests saved by coalescing and of requests with credentials
+        stats = self.http.cache.stats()
+        stats['coalesced'] = self.http.coalesced
+        stats['authRoundTrips'] = self.http.authRoundTrips
+        return stats
 
     def getGroupNames(self):
         return [x['name'] for x in self.groups]
@@ -282,14 +563,24 @@ class ShogunRessource:
         # have to save the sld to a file, then do layer.loadSldStyle(file)
         # can someone fix it?#
 
-        shogunlayer = qgisLayerItem.parentShogunLayer
+        response = self.requestStyle(qgisLayerItem.parentShogunLayer).result()
+        dirpath = os.path.dirname(__file__)
+        filename = os.path.join(dirpath, 'latest-symbology.sld')
+        return self.saveStyle(response, filename)
+
+    def requestStyle(self, shogunlayer, callback = None):
+        # the GetStyles request for the style of a layer, it does not block,
+        # see saveStyle() for reading the response
         url = shogunlayer.source['url']
         if url.startswith('/shogun2-webapp'):
             url = self.baseurl.rstrip('/shogun2-webapp/rest/') + url
             url += '?service=WMS&request=GetStyles&version=1.1.1&layers='
             url += shogunlayer.source['layerNames']
-        response = self.http.request(url, authenticate = False)
+        return self.http.requestAsync(url, authenticate = False, callback = callback)
 
+    def saveStyle(self, response, filename):
+        # saves the sld of a GetStyles response to filename and returns the
+        # filename and the name of the style in the geoserver
         mydoc = QDomDocument()
         mydoc.setContent(response[1])
         root = mydoc.firstChildElement('sld:StyledLayerDescriptor')
@@ -326,8 +617,6 @@ class ShogunRessource:
                         iconPath = self.downloadIconThumbnail(id)
         '''
 
-        dirpath = os.path.dirname(__file__)
-        filename = os.path.join(dirpath, 'latest-symbology.sld')
         with open(filename, 'w') as file:
             file.write(response[1])
         return filename, geoServerStyleName
@@ -340,7 +629,7 @@ class ShogunRessource:
         b = 'sld=' + sld + '&sldName=' + qgisLayerItem.stylename + '&layerId='
         b += str(qgisLayerItem.parentShogunLayer.id)
         response = self.http.request(url, method = 'POST', body = b, headers = h)
-        if json.loads(response[1])['success']:
+        if response.json()['success']:
             return True
         else:
             return False
@@ -366,6 +655,13 @@ class ShogunRessource:
         return False
 
 
+    def downloadToFile(self, url, path, progress = None):
+        # streams the response body to the file at path without keeping it
+        # in memory, progress is called with the TransferStats of the download
+        response = self.http.request(url, sink = path, progress = progress)
+        return response[0]['bytesReceived']
+
+
     # # NOTE: the following method is still not used:
     def downloadIconThumbnail(self, id):
         iconPath = os.path.join(self.icondir, str(icon['id']) + '.png')
@@ -377,7 +673,7 @@ class ShogunRessource:
             return iconPath
 
 
-    def uploadImage(self, pathToImage):
+    def uploadImage(self, pathToImage, progress = None):
         img = QFile(pathToImage)
         img.open(QIODevice.ReadOnly)
         imgPart = QHttpPart()
@@ -391,11 +687,12 @@ class ShogunRessource:
 
         url = self.baseurl + 'projectimage/upload.action?'
 
-        response = self.http.request(url, method = 'POST', body = multiPart)
+        response = self.http.request(url, method = 'POST', body = multiPart,
+            uploadProgress = progress)
         if response[0]['status'] > 199 and response[0]['status'] < 210:
             # if icon upload was successfull, server returns id of the new icon
             # in it's database
-            id = json.loads(response[1])['data']['id']
+            id = response.json()['data']['id']
             return id
         else:
             return False
@@ -410,7 +707,9 @@ class ShogunRessource:
         self.userInfo(response[0]['status'], 'New WMS layer', 'published')
 
 
-    def uploadLayer(self, pathToZipFile, dataType):
+    def uploadLayer(self, pathToZipFile, dataType, progress = None):
+        # progress is called with the TransferStats of the upload, the upload
+        # can be aborted with cancelUpload() while it is running
         url = self.baseurl + '/import/create-layer.action'
 
         # the following creates a QHttpMultiPart with 2 parts, one defining the
@@ -435,8 +734,16 @@ class ShogunRessource:
         multipart.append(textpart)
         multipart.append(layerpart)
 
-        response = self.http.request(url, method = 'POST', body = multipart)
-        res = json.loads(response[1])
+        # importing a large layer can keep the server busy for a long time
+        # after the upload, so there is no idle timeout
+        self.currentUpload = self.http.requestAsync(url, method = 'POST',
+            body = multipart, uploadProgress = progress,
+            timeouts = Timeouts(idle = None))
+        try:
+            response = self.currentUpload.result()
+        finally:
+            self.currentUpload = None
+        res = response.json()
         if res['success']:
             self.userInfo(response[0]['status'], 'New Vector Layer', 'uploaded')
         else:
@@ -446,6 +753,10 @@ class ShogunRessource:
                 self.userInfo(response[0]['status'], 'New Vector Layer', 'uploaded')
         return response[0]['status']
 
+    def cancelUpload(self):
+        if self.currentUpload is not None:
+            self.currentUpload.cancel()
+
     def requestCrsUpdateOnLayer(self, importJobId):
         url = self.baseurl + '/import/update-crs-for-import.action'
         data = 'importJobId=' + str(importJobId) + '&taskId=0&fileProjection=EPSG%3A3857&layerName=&dataType=Vector'
@@ -458,7 +769,7 @@ class ShogunRessource:
         response = self.http.request(url)
         if response[0]['status'] == 200 or response[0]['status'] == 201:
             fieldNames = []
-            answer = json.loads(response[1])
+            answer = response.json()
             if answer['featureTypes'][0]['properties']:
                 for prop in answer['featureTypes'][0]['properties']:
                     fieldNames.append(prop['name'])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+from qgis.core import QgsApplication
+
+
+class CatalogSnapshot():
+    ''' A copy of the catalog collections of one connection in an SQLite
+    database, so that the tree can be shown from it when the connection is
+    set up again before anything has been downloaded. Besides the entities
+    the cache validators of the catalog urls are kept, the collections can
+    then be revalidated with conditional requests.
+
+    A database with another schema version is recreated, a snapshot larger
+    than maxSize is not saved'''
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, maxSize = 20 * 1024 * 1024):
+        self.path = path
+        self.maxSize = maxSize
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path)
+        self.migrate()
+
+    def migrate(self):
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+        with self.db:
+            self.db.execute('DROP TABLE IF EXISTS entities')
+            self.db.execute('DROP TABLE IF EXISTS meta')
+            self.db.execute('CREATE TABLE entities (collection TEXT, '
+                'position INTEGER, detailed INTEGER, data TEXT, '
+                'PRIMARY KEY (collection, position))')
+            self.db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('PRAGMA user_version = {0}'.format(self.SCHEMA_VERSION))
+
+    def isEmpty(self):
+        return self.db.execute('SELECT COUNT(*) FROM entities').fetchone()[0] == 0
+
+    def save(self, stores, validators = None):
+        ''' Replaces the snapshot with the entities of stores (a dict of
+        collection name -> CatalogStore) and the validators (url -> dict),
+        returns False if it would exceed maxSize'''
+        rows = []
+        size = 0
+        for collection, store in stores.items():
+            for position, entity in enumerate(store):
+                data = json.dumps(entity)
+                size += len(data)
+                rows.append((collection, position,
+                    int(store.isDetailed(entity['id'])), data))
+        if size > self.maxSize:
+            self.clear()
+            return False
+        with self.db:
+            self.db.execute('DELETE FROM entities')
+            self.db.execute('DELETE FROM meta')
+            self.db.executemany('INSERT INTO entities VALUES (?, ?, ?, ?)', rows)
+            self.db.execute('INSERT INTO meta VALUES (?, ?)',
+                ('validators', json.dumps(validators or {})))
+            self.db.execute('INSERT INTO meta VALUES (?, ?)',
+                ('saved', str(time.time())))
+        return True
+
+    def load(self, stores):
+        ''' Restores the stores from the snapshot and returns the saved
+        validators, or None if there is no snapshot'''
+        if self.isEmpty():
+            return None
+        for collection, store in stores.items():
+            entities = []
+            detailed = []
+            for flag, data in self.db.execute('SELECT detailed, data FROM '
+                    'entities WHERE collection = ? ORDER BY position', (collection,)):
+                entity = json.loads(data)
+                entities.append(entity)
+                if flag:
+                    detailed.append(entity['id'])
+            store.restore(entities, detailed)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'validators'").fetchone()
+        return json.loads(row[0]) if row is not None else {}
+
+    def clear(self):
+        with self.db:
+            self.db.execute('DELETE FROM entities')
+            self.db.execute('DELETE FROM meta')
+
+    def close(self):
+        self.db.close()
+
+
+def removeStaleSnapshots(directory, keep, maxAge = 90 * 24 * 3600):
+    ''' Removes the snapshots in directory but keep that have not been saved
+    for maxAge seconds, and those named after the credentials by earlier
+    versions'''
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        if name == keep or not name.endswith('.sqlite'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if not name.startswith('catalog-') or now - os.path.getmtime(path) > maxAge:
+                os.remove(path)
+        except OSError:
+            # still open by another connection
+            pass
+
+
+def snapshotFor(baseurl, user):
+    ''' Returns the snapshot of the connection to baseurl for user, located
+    in the active QGIS profile directory. Stale snapshots are removed'''
+    text = '\n'.join([baseurl, user or ''])
+    name = 'catalog-' + hashlib.sha1(text.encode('utf-8')).hexdigest() + '.sqlite'
+    directory = os.path.join(QgsApplication.qgisSettingsDirPath(),
+        'shoguneditor', 'snapshots')
+    removeStaleSnapshots(directory, name)
+    return CatalogSnapshot(os.path.join(directory, name))
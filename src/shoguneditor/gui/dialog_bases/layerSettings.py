@@ -227,7 +227,7 @@ class UploadLayerDialog(QtGui.QDialog):
         self.setupUi()
 
     def setupUi(self):
-        self.resize(400, 400)
+        self.resize(400, 440)
         self.setWindowTitle('Upload layer to Shogun')
 
         title = QtGui.QLabel(self)
@@ -246,11 +246,49 @@ class UploadLayerDialog(QtGui.QDialog):
         self.cancelButton.setText('Cancel')
         self.cancelButton.clicked.connect(self.hide)
 
+        self.progressBar = QtGui.QProgressBar(self)
+        self.progressBar.setGeometry(QRect(50, 205, 300, 20))
+        self.progressBar.setRange(0, 100)
+        self.progressBar.setHidden(True)
+
+        self.progressLabel = QtGui.QLabel(self)
+        self.progressLabel.setGeometry(QRect(50, 228, 300, 20))
+
         self.logWindow = QtGui.QTextEdit(self)
-        self.logWindow.setGeometry(QRect(50, 200, 300, 180))
+        self.logWindow.setGeometry(QRect(50, 255, 300, 165))
         self.logWindow.setReadOnly(True)
         self.logWindow.setText('Upload Log:')
+        self.lastStats = None
 
     def log(self, message):
         msg = ' - ' + message
         self.logWindow.append(msg)
+
+    def startProgress(self, cancel):
+        # while uploading, the cancel button aborts the upload instead of
+        # closing the dialog
+        self.cancelButton.clicked.disconnect(self.hide)
+        self.cancelButton.clicked.connect(cancel)
+        self.cancelButton.setText('Stop Upload')
+        self.uploadButton.setEnabled(False)
+        self.progressBar.setValue(0)
+        self.progressBar.setHidden(False)
+        self.progressLabel.setText('')
+        self.lastStats = None
+
+    def showProgress(self, stats):
+        # stats is the TransferStats of the running upload
+        self.lastStats = stats
+        fraction = stats.fraction()
+        if fraction is not None:
+            self.progressBar.setValue(int(fraction * 100))
+        self.progressLabel.setText(str(stats))
+
+    def stopProgress(self, cancel):
+        self.cancelButton.clicked.disconnect(cancel)
+        self.cancelButton.clicked.connect(self.hide)
+        self.cancelButton.setText('Cancel')
+        self.uploadButton.setEnabled(True)
+        self.progressBar.setHidden(True)
+        if self.lastStats is not None:
+            self.log('Sent ' + str(self.lastStats))
@@ -10,11 +10,11 @@ __date__ = 'July 2018'
 import sys
 
 if sys.version_info[0] >= 3:
-    from qgis.PyQt.QtCore import QObject, Qt, QTimer
+    from qgis.PyQt.QtCore import QObject, Qt, QTimer, QSettings
     from qgis.PyQt.QtWidgets import QMenu, QAction, QMessageBox
     from qgis.PyQt.QtWidgets import QTreeWidgetItemIterator
 else:
-    from PyQt4.QtCore import QObject, Qt, QTimer
+    from PyQt4.QtCore import QObject, Qt, QTimer, QSettings
     from PyQt4.QtGui import QMenu, QAction, QMessageBox, QTreeWidgetItemIterator
 
 from qgis.gui import QgsMessageBar
@@ -23,6 +23,7 @@ from qgis.core import QgsNetworkAccessManager
 from .dialog_bases.connectdlg import ConnectDialog
 from .dialog_bases.dockwidget import DockWidget
 from .editoritems import EditorItem, EditorTopItem, QgisLayerItem, ApplicationItem, LayerItem
+from .layerloader import LayerBatchLoader
 from shoguneditor.connection.shogunressource import ShogunRessource
 
 
@@ -41,10 +42,12 @@ class Editor(QObject):
         self.connectdlg.okButton.clicked.connect(self.setupNewConnection)
         self.topitem = EditorTopItem()
         self.connections = []
+        self.layerLoaders = []
         self.dock.treeWidget.addTopLevelItem(self.topitem)
         self.dock.treeWidget.setContextMenuPolicy(Qt.CustomContextMenu)
         self.dock.treeWidget.customContextMenuRequested.connect(self.on_context_menu)
         self.dock.treeWidget.itemDoubleClicked.connect(self.on_tree_item_double_clicked)
+        self.dock.treeWidget.itemSelectionChanged.connect(self.prefetchSelection)
 
         self.timer = QTimer()
 
@@ -82,11 +85,19 @@ class Editor(QObject):
                         ('Upload New Style', 'Apply Original Style'),
                     'applicationsItem':
                         ('Create New Application', 'Refresh Applications'),
-                    'layersItem':('Upload New Layer from QGIS', 'Refresh Layers'),
+                    'layersItem':('Upload New Layer from QGIS', 'Refresh Layers',
+                        'Show Orphan Layers'),
                     'connection':('Refresh Connection', 'Remove Connection'),
                     'topitem':['New Connection']}
 
         actions = actionDict[item.actiontype]
+        if item.actiontype == 'connection':
+            if item.isSyncing():
+                syncAction = 'Stop Background Sync'
+            else:
+                syncAction = 'Start Background Sync'
+            actions = list(actions)
+            actions.insert(1, syncAction)
         menu = QMenu()
         acts = []
         for actionName in actions:
@@ -113,6 +124,10 @@ class Editor(QObject):
             action.triggered.connect(lambda: self.removeConnection(item))
         elif actionName == 'Refresh Connection':
             action.triggered.connect(lambda: self.refreshConnection(item))
+        elif actionName == 'Start Background Sync':
+            action.triggered.connect(lambda: self.startSync(item))
+        elif actionName == 'Stop Background Sync':
+            action.triggered.connect(item.stopSync)
         elif actionName == 'Add Layer to QGIS':
             action.triggered.connect(lambda: item.addQgsLayer(self.iface))
         elif actionName == 'Upload New Style':
@@ -133,6 +148,8 @@ class Editor(QObject):
             action.triggered.connect(item.update)
         elif actionName == 'Refresh Layers':
             action.triggered.connect(item.update)
+        elif actionName == 'Show Orphan Layers':
+            action.triggered.connect(item.showOrphanLayers)
 
 
     def on_tree_item_double_clicked(self, item):
@@ -143,6 +160,16 @@ class Editor(QObject):
                 pass
 
 
+    def prefetchSelection(self):
+        # the permissions of the selected applications and layers are loaded
+        # in the background, so that their settings dialogs open at once
+        for item in self.dock.treeWidget.selectedItems():
+            if isinstance(item, ApplicationItem):
+                item.ressource.prefetchPermissions([item.id], 'Application')
+            elif isinstance(item, LayerItem):
+                item.ressource.prefetchPermissions([item.id], 'Layer')
+
+
     def showDialog(self, item):
         if not isinstance(item, ConnectDialog):
             if item.dlg is None:
@@ -196,31 +223,55 @@ class Editor(QObject):
             self.connectdlg.show()
             return
 
-        bool = newRessource.updateData()
-        if not bool:
-            self.showWarning(self.connectdlg, 'Error: Could not retrieve all '
-                'data from Shogun')
-
         self.connectdlg.hide()
 
+        # the connection is shown right away, from the snapshot of the last
+        # session if there is one, otherwise its applications and layers
+        # appear while they are loaded
+        fromSnapshot = newRessource.loadSnapshot()
         newConnectionItem = EditorItem(newRessource)
         self.connections.append(name)
         self.topitem.addChild(newConnectionItem)
         self.topitem.setExpanded(True)
-        newConnectionItem.applicationsitem.sortChildren(0, Qt.AscendingOrder)
-        newConnectionItem.layersitem.sortChildren(0, Qt.AscendingOrder)
         self.expandEditorTree(newConnectionItem)
 
+        if fromSnapshot:
+            QTimer.singleShot(0, lambda: self.revalidateConnection(newConnectionItem))
+            return
+
+        bool = newRessource.updateData(onEntity = newConnectionItem.streamEntity)
+        newConnectionItem.streamFinished()
+        if not bool:
+            self.showWarning(self.connectdlg, 'Error: Could not retrieve all '
+                'data from Shogun')
+
     def removeConnection(self, item):
+        item.stopSync()
         if item.name in self.connections:
             self.connections.remove(item.name)
         self.topitem.removeChild(item)
 
-    def refreshConnection(self, item):
+    def revalidateConnection(self, item):
+        # brings a connection shown from its snapshot up to date
+        if item.name not in self.connections:
+            return
         item.ressource.updateData()
         item.update()
+
+    def startSync(self, item):
+        # the interval in seconds can be set with the QGIS setting
+        # shoguneditor/syncInterval, it grows up to syncMaxInterval while
+        # nothing changes
+        settings = QSettings()
+        interval = int(settings.value('shoguneditor/syncInterval', 60))
+        maxInterval = int(settings.value('shoguneditor/syncMaxInterval', 900))
+        item.startSync(interval, max(interval, maxInterval))
+
+    def refreshConnection(self, item):
+        # the tree is patched, so the items keep their expansion state
+        item.ressource.updateData(useCache = False)
+        item.update()
         self.topitem.setExpanded(True)
-        self.expandEditorTree(item)
 
     def showWarning(self, parent, text):
         warn = QMessageBox.warning(parent, 'Warning',
@@ -245,9 +296,25 @@ class Editor(QObject):
 
     def loadAllAppLayers(self, item):
         layerIds, shogunConnectionItem = item.getAllAppLayersById()
-        for layer in shogunConnectionItem.layersitem.layerlist:
-            if layer.id in layerIds:
-                layer.addQgsLayer(self.iface)
+        layerItems = {layer.id: layer for layer in shogunConnectionItem.layersitem.layerlist}
+        # in the order of the layer tree of the application
+        layerItems = [layerItems[id] for id in layerIds if id in layerItems]
+        if len(layerItems) == 0:
+            return
+        # the folders of the application are recreated in the QGIS layer tree
+        layerTree = item.ressource.getApplicationAttrsById(item.id)['layerTree']
+        loader = LayerBatchLoader(self.iface, layerItems, layerTree, item.name)
+        loader.finished.connect(lambda qgisLayerItems: self.appLayersLoaded(loader, qgisLayerItems))
+        self.layerLoaders.append(loader)
+        self.iface.messageBar().pushInfo('Info', 'Loading ' + str(len(layerItems))
+            + ' layers of application ' + item.name)
+        loader.start()
+
+    def appLayersLoaded(self, loader, qgisLayerItems):
+        if loader in self.layerLoaders:
+            self.layerLoaders.remove(loader)
+        msg = str(len(qgisLayerItems)) + ' layers were loaded to QGIS'
+        self.iface.messageBar().pushSuccess('Success', msg)
 
     def expandEditorTree(self, connectionItem):
         iter = QTreeWidgetItemIterator(connectionItem)
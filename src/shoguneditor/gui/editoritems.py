@@ -24,7 +24,10 @@ else:
 from qgis.core import QgsMapLayer, QgsProject, QgsLayerItem
 from qgis.core import QgsRectangle
 
-from shoguneditor.layerutils import prepareLayerForUpload, createLayer
+from shoguneditor.layerutils import prepareLayerForUpload, createLayer, mapCanvasEpsg
+from shoguneditor.connection.networkaccessmanager import RequestsException, RequestsExceptionCancelled
+from shoguneditor.connection.catalog import catalogMarker
+from shoguneditor.connection.backgroundsync import BackgroundSync
 from .dialog_bases.applicationSettings import ApplicationSettingsDialog
 from .dialog_bases.layerSettings import LayerSettingsDialog, UploadLayerDialog
 
@@ -77,25 +80,70 @@ class EditorItem(TreeItem):
         font.setBold(True)
         self.setFont(0,font)
         self.populateTree(shogunRessource)
+        # the BackgroundSync, once it has been switched on
+        self.sync = None
 
     def disconnectSignals(self):
         if self.layersitem is not None:
             for layer in self.layersitem.layerlist:
-                if PYTHON_VERSION >= 3:
-                    try:
-                        QgsProject.instance().layerRemoved.disconnect(layer.updateLayerList)
-                    except:
-                        pass
-                else:
-                    try:
-                        QgsMapLayerRegistry.instance().layerRemoved.disconnect(layer.updateLayerList)
-                    except:
-                        pass
+                layer.disconnectSignals()
 
     def update(self):
-        for x in [self.applicationsitem, self.layersitem]:
-            self.removeChild(x)
-        self.populateTree(self.ressource)
+        # only the applications and layers that were added, removed or changed
+        # since the subtrees were populated are patched, all other items
+        # stay as they are
+        self.applicationsitem.applyDelta()
+        self.layersitem.applyDelta()
+
+    def startSync(self, interval, maxInterval):
+        if self.sync is None:
+            self.sync = BackgroundSync(self.ressource, interval, maxInterval)
+            self.sync.added.connect(self.catalogChanged)
+            self.sync.changed.connect(self.catalogChanged)
+            self.sync.removed.connect(self.catalogChanged)
+        self.sync.start()
+
+    def stopSync(self):
+        if self.sync is not None:
+            self.sync.stop()
+
+    def isSyncing(self):
+        return self.sync is not None and self.sync.isActive()
+
+    def catalogChanged(self, attr, ids):
+        if attr == 'applications':
+            self.applicationsitem.applyDelta()
+        elif attr == 'layers':
+            self.layersitem.applyDelta()
+
+    def streamEntity(self, attr, entity):
+        # adds the applications and layers while the catalogs are streamed
+        # in by ShogunRessource.updateData(onEntity = ...), a catalog that is
+        # sent again after a failed attempt repeats the entities
+        if attr == 'applications':
+            item = self.applicationsitem
+        elif attr == 'layers':
+            item = self.layersitem
+        else:
+            return
+        if entity['id'] not in item.markers:
+            item.addEntity(entity)
+
+    def streamFinished(self):
+        # a catalog whose stream failed is requested once more, the items of
+        # the streamed ones are complete and only need to be sorted
+        errors = self.ressource.updateErrors
+        for endpoint, item in [('rest/applications', self.applicationsitem),
+                               ('rest/layers', self.layersitem)]:
+            if endpoint in errors:
+                try:
+                    item.update()
+                except (RequestsException, ValueError):
+                    # the items that are not in the store are dropped
+                    item.applyDelta()
+            else:
+                item.applyDelta()
+            item.sortChildren(0, Qt.AscendingOrder)
 
     def populateTree(self, shogunRessource):
         self.applicationsitem = ApplicationsItem(shogunRessource)
@@ -110,13 +158,15 @@ class ApplicationsItem(TreeItem):
         TreeItem.__init__(self, 'applications-logo.png', 'Applications')
         self.ressource = ressource
         self.applications = self.ressource.getApplicationIdsAndNames()
+        self.catalogVersion = self.ressource.applications.version
         self.applicationlist = []
         self.actiontype = 'applicationsItem'
         font = QFont('Arial',10)
         font.setBold(True)
         self.setFont(0,font)
         self.populate()
-
+        # the markers of the applications the items show, see applyDelta()
+        self.markers = self.ressource.applications.markers()
 
     def createNewApplication(self, iface):
         self.newApplication = ApplicationItem(None, '', self.ressource)
@@ -200,16 +250,36 @@ class ApplicationsItem(TreeItem):
             self.applicationlist.append(item)
         self.sortChildren(0, Qt.AscendingOrder)
 
+    def addEntity(self, entity):
+        item = ApplicationItem(entity['id'], entity['name'], self.ressource)
+        self.addChild(item)
+        self.applicationlist.append(item)
+        self.markers[entity['id']] = catalogMarker(entity)
+
     def update(self):
         self.applications = self.ressource.getApplicationIdsAndNames(reload = True)
-        for item in self.applicationlist:
-            self.removeChild(item)
-        self.applicationlist = []
-        for app in self.applications:
-            item = ApplicationItem(app[0], app[1], self.ressource)
-            self.addChild(item)
-            self.applicationlist.append(item)
-        self.sortChildren(0, Qt.AscendingOrder)
+        self.applyDelta()
+
+    def applyDelta(self):
+        store = self.ressource.applications
+        # items streamed in from a catalog that failed are not in the store
+        if self.catalogVersion == store.version and \
+                all(id in store for id in self.markers):
+            return
+        delta = store.diff(self.markers)
+        items = {item.id: item for item in self.applicationlist}
+        for id in delta.removed:
+            self.removeChild(items[id])
+            self.applicationlist.remove(items[id])
+        for id in delta.changed:
+            items[id].name = store.get(id)['name']
+            items[id].setText(0, items[id].name)
+        for id in delta.added:
+            self.addEntity(store.get(id))
+        self.markers = store.markers()
+        self.catalogVersion = store.version
+        if not delta.isEmpty():
+            self.sortChildren(0, Qt.AscendingOrder)
 
 
 
@@ -386,8 +456,8 @@ class ApplicationItem(TreeItem):
         self.dlg.layerlistwidget.populateList(allLayers)
 
         # populate the permissions tables
-        self.userPermissions = self.ressource.getObjectPermissions(self.id, 'Application', 'User')
-        self.groupPermissions = self.ressource.getObjectPermissions(self.id, 'Application', 'UserGroup')
+        self.userPermissions, self.groupPermissions = self.ressource.getPermissions(
+            self.id, 'Application')
 
         if not self.userPermissions['success'] or not self.groupPermissions['success']:
             self.dlg.noPermissionAccess()
@@ -397,31 +467,8 @@ class ApplicationItem(TreeItem):
 
     def getAllAppLayersById(self):
         rootConnectionItem = self.parent().parent()
-        settings = self.ressource.getApplicationAttrsById(self.id)
-        listOfIds = []
-        layerTree = settings['layerTree']
-
-        # for reasons of simplicity we only search for belonging layers down to the
-        # third level of the tree
-        if layerTree['leaf']:
-            listOfIds.append(layerTree['layer']['id'])
-            return listOfIds, rootConnectionItem
-        else:
-            children = layerTree['children']
-            for child in children:
-                if child['leaf']:
-                    listOfIds.append(child['layer']['id'])
-                else:
-                    children = child['children']
-                    for child in children:
-                        if child['leaf']:
-                            listOfIds.append(child['layer']['id'])
-                        else:
-                            children = child['children']
-                            for child in children:
-                                if child['leaf']:
-                                    listOfIds.append(child['layer']['id'])
-            return listOfIds, rootConnectionItem
+        layerPaths = self.ressource.getApplicationLayerPaths(self.id)
+        return list(layerPaths.keys()), rootConnectionItem
 
 
     def getAllChanges(self):
@@ -628,10 +675,8 @@ class ApplicationItem(TreeItem):
                             if not responseBool:
                                 responses = 400
 
-                    self.userPermissions = self.ressource.getObjectPermissions(
-                            self.id, 'Application', 'User')
-                    self.groupPermissions = self.ressource.getObjectPermissions(
-                            self.id, 'Application', 'UserGroup')
+                    self.userPermissions, self.groupPermissions = \
+                        self.ressource.getPermissions(self.id, 'Application')
                     self.ressource.userInfo(responses,
                         'Application permissions', 'updated')
 
@@ -679,12 +724,15 @@ class LayersItem(TreeItem):
         TreeItem.__init__(self, 'layers-logo.png', 'Layers')
         self.ressource = ressource
         self.layers = self.ressource.getLayerIdsAndNames()
+        self.catalogVersion = self.ressource.layers.version
         self.layerlist = []
         self.actiontype = 'layersItem'
         font = QFont('Arial',10)
         font.setBold(True)
         self.setFont(0,font)
         self.populate()
+        # the markers of the layers the items show, see applyDelta()
+        self.markers = self.ressource.layers.markers()
 
     def populate(self):
         for layer in self.layers:
@@ -693,26 +741,51 @@ class LayersItem(TreeItem):
             self.layerlist.append(item)
         self.sortChildren(0, Qt.AscendingOrder)
 
+    def addEntity(self, entity):
+        item = LayerItem(entity['id'], entity['name'], entity['dataType'],
+                         entity['source'], self.ressource)
+        self.addChild(item)
+        self.layerlist.append(item)
+        self.markers[entity['id']] = catalogMarker(entity)
+
     def update(self):
         #update the list of current shogun layers:
         self.layers = self.ressource.getLayerIdsAndNames(reload = True)
-        layerIdList = [layer[0] for layer in self.layers]
-        #remove every item that is not in the updated list:
-        for layer in self.layerlist:
-            if layer.id not in layerIdList:
-                self.removeChild(layer)
-                self.layerlist.remove(layer)
-
-        #check if new layers appeared and append them:
-        currentLayerIdList = [layer.id for layer in self.layerlist]
-        for layer in self.layers:
-            if layer[0] not in currentLayerIdList:
-                item = LayerItem(layer[0], layer[1], layer[2], layer[3], self.ressource)
-                self.addChild(item)
-                self.layerlist.append(item)
-        self.sortChildren(0, Qt.AscendingOrder)
-
-
+        self.applyDelta()
+
+    def applyDelta(self):
+        # the items of changed layers are kept together with the QGIS layers
+        # loaded from them
+        store = self.ressource.layers
+        # items streamed in from a catalog that failed are not in the store
+        if self.catalogVersion == store.version and \
+                all(id in store for id in self.markers):
+            return
+        delta = store.diff(self.markers)
+        items = {item.id: item for item in self.layerlist}
+        for id in delta.removed:
+            items[id].disconnectSignals()
+            self.removeChild(items[id])
+            self.layerlist.remove(items[id])
+        for id in delta.changed:
+            items[id].updateEntity(store.get(id))
+        for id in delta.added:
+            self.addEntity(store.get(id))
+        self.markers = store.markers()
+        self.catalogVersion = store.version
+        if not delta.isEmpty():
+            self.sortChildren(0, Qt.AscendingOrder)
+
+
+
+    def showOrphanLayers(self):
+        orphans = sorted(name for id, name in self.ressource.getOrphanLayers())
+        if len(orphans) == 0:
+            txt = 'Every layer is used by at least one application'
+        else:
+            txt = str(len(orphans)) + ' layer(s) are not used by any application:\n'
+            txt += '\n'.join(orphans)
+        QMessageBox.information(None, 'Orphan Layers', txt, QMessageBox.Ok)
 
     def createNewLayer(self, iface):
         self.uploadDialog = UploadLayerDialog()
@@ -743,11 +816,21 @@ class LayersItem(TreeItem):
 
                 else:
                     type = 'Raster'
-            success = self.ressource.uploadLayer(pathToZipFile, type)
+            self.uploadDialog.startProgress(self.ressource.cancelUpload)
+            cancelled = False
+            try:
+                success = self.ressource.uploadLayer(pathToZipFile, type,
+                    progress = self.uploadDialog.showProgress)
+            except RequestsExceptionCancelled:
+                self.uploadDialog.log('Uploading layer ' + layer.name() + ' was cancelled')
+                success = False
+                cancelled = True
+            finally:
+                self.uploadDialog.stopProgress(self.ressource.cancelUpload)
             if success:
                 self.uploadDialog.log('Layer ' + layer.name() + ' was successfully uploaded')
                 self.update()
-            else:
+            elif not cancelled:
                 self.uploadDialog.log('Uploading layer ' + layer.name() + ' was not successfull')
             # after the process has finished we delete the created zipfile and
             # temporary directory for cleaning up
@@ -794,6 +877,24 @@ class LayerItem(TreeItem):
             QgsMapLayerRegistry.instance().layerRemoved.connect(self.updateLayerList)
 
 
+    def updateEntity(self, entity):
+        self.name = entity['name']
+        self.source = entity['source']
+        self.datatype = entity['dataType']
+        self.setText(0, self.name)
+
+    def disconnectSignals(self):
+        if PYTHON_VERSION >= 3:
+            try:
+                QgsProject.instance().layerRemoved.disconnect(self.updateLayerList)
+            except:
+                pass
+        else:
+            try:
+                QgsMapLayerRegistry.instance().layerRemoved.disconnect(self.updateLayerList)
+            except:
+                pass
+
     def updateLayerList(self):
         if self.qgisLayers == []:
             return
@@ -808,16 +909,15 @@ class LayerItem(TreeItem):
 
 
     def addQgsLayer(self, iface):
-        currentCrs = iface.mapCanvas().mapSettings().destinationCrs()
-        if currentCrs.isValid():
-            epsg = currentCrs.authid()
-        else:
-            epsg = 'EPSG:3857'
         # layerutils
-        layer = createLayer(self, epsg)
+        layer = createLayer(self, mapCanvasEpsg(iface))
         if not layer:
             return
-        qgisLayerItem = QgisLayerItem(layer, self, self.ressource)
+        self.attachQgsLayer(QgisLayerItem(layer, self, self.ressource))
+
+    def attachQgsLayer(self, qgisLayerItem):
+        # shows a layer that was added to the project below this item
+        layer = qgisLayerItem.layer
         self.qgisLayers.append(qgisLayerItem)
         self.addChild(qgisLayerItem)
         self.setExpanded(True)
@@ -882,8 +982,8 @@ class LayerItem(TreeItem):
         if settings['appearance']['hoverTemplate'] is not None:
             self.dlg.hoverEdit.setText(settings['appearance']['hoverTemplate'])
 
-        self.userPermissions = self.ressource.getObjectPermissions(self.id, 'Layer', 'User')
-        self.groupPermissions = self.ressource.getObjectPermissions(self.id, 'Layer', 'UserGroup')
+        self.userPermissions, self.groupPermissions = self.ressource.getPermissions(
+            self.id, 'Layer')
 
         if not self.userPermissions['success'] or not self.groupPermissions['success']:
             self.dlg.noPermissionAccess()
@@ -1030,10 +1130,8 @@ class LayerItem(TreeItem):
                                 responses = 400
 
                     # update the class variable copy of the permissions
-                    self.userPermissions = self.ressource.getObjectPermissions(
-                            self.id, 'Layer', 'User')
-                    self.groupPermissions = self.ressource.getObjectPermissions(
-                            self.id, 'Layer', 'UserGroup')
+                    self.userPermissions, self.groupPermissions = \
+                        self.ressource.getPermissions(self.id, 'Layer')
                     self.ressource.userInfo(responses, 'Layer permissions', 'updated')
 
             # if the user clicked 'cancel' just return and stay in edit mode:
@@ -1057,6 +1155,13 @@ class LayerItem(TreeItem):
 
     def deleteLayer(self):
         txt = 'Please confirm you want to permanently delete the selected layer in Shogun'
+        applications = sorted(name for id, name in
+            self.ressource.getApplicationsUsingLayer(self.id))
+        if len(applications) > 0:
+            txt += '\n\nThe layer is used by ' + str(len(applications))
+            txt += ' application(s):\n' + '\n'.join(applications[:15])
+            if len(applications) > 15:
+                txt += '\n...'
         conf = QMessageBox.warning(self.dlg, 'Confirm',txt , QMessageBox.Cancel, QMessageBox.Ok)
         if conf == QMessageBox.Ok:
             self.ressource.deleteLayer(self.id)
@@ -1065,7 +1170,10 @@ class LayerItem(TreeItem):
 
 
 class QgisLayerItem(TreeItem):
-    def __init__(self, qgislayer, shogunLayerItem, ressource):
+    ''' A layer of the QGIS project that was created from a Shogun layer.
+    With register = False the layer is neither added to the project nor
+    styled, the caller does that (see LayerBatchLoader)'''
+    def __init__(self, qgislayer, shogunLayerItem, ressource, register = True):
         TreeItem.__init__(self, None, qgislayer.name())
         self.layer = qgislayer
         self.id = self.layer.id()
@@ -1078,12 +1186,13 @@ class QgisLayerItem(TreeItem):
             self.actiontype = None
         self.parentShogunLayer = shogunLayerItem
         self.ressource = ressource
-        if PYTHON_VERSION >= 3:
-            QgsProject.instance().addMapLayer(self.layer)
-        else:
-            QgsMapLayerRegistry.instance().addMapLayer(self.layer)
-        if self.layer.type() == QgsMapLayer.VectorLayer:
-            self.downloadStyle()
+        if register:
+            if PYTHON_VERSION >= 3:
+                QgsProject.instance().addMapLayer(self.layer)
+            else:
+                QgsMapLayerRegistry.instance().addMapLayer(self.layer)
+            if self.layer.type() == QgsMapLayer.VectorLayer:
+                self.downloadStyle()
         self.layer.nameChanged.connect(self.on_name_changed)
 
 
@@ -1099,10 +1208,16 @@ class QgisLayerItem(TreeItem):
 
     def downloadStyle(self):
         sld, geoServerStyleName = self.ressource.downloadStyle(self)
+        if self.applyStyle(sld, geoServerStyleName):
+            self.layer.triggerRepaint()
+            return True
+        else:
+            return False
+
+    def applyStyle(self, sld, geoServerStyleName):
         self.stylename = geoServerStyleName
         if sld is not None:
             self.layer.loadSldStyle(sld)
-            self.layer.triggerRepaint()
             return True
         else:
             return False
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+'''
+(c) 2018 terrestris GmbH & Co. KG, https://www.terrestris.de/en/
+ This code is licensed under the GPL 2.0 license.
+'''
+
+__author__ = 'Jonas Grieb'
+__date__ = 'July 2018'
+
+import sys
+import os
+import tempfile
+
+if sys.version_info[0] >= 3:
+    from qgis.PyQt.QtCore import QObject, QCoreApplication, Qt, pyqtSignal
+    from qgis.core import QgsProject, QgsTask
+else:
+    from PyQt4.QtCore import QObject, QCoreApplication, Qt, pyqtSignal
+    from qgis.core import QgsMapLayerRegistry, QgsProject
+
+from qgis.core import QgsApplication, QgsMapLayer, QgsLayerTreeGroup, QgsLayerTreeLayer
+
+from shoguneditor.layerutils import createLayer, mapCanvasEpsg, UNATTENDED_DATATYPES
+from shoguneditor.connection.networkaccessmanager import RequestsException
+from shoguneditor.connection.layerindex import sortedChildren
+from .editoritems import QgisLayerItem
+
+PYTHON_VERSION = sys.version_info[0]
+
+
+def createLayerInTask(task, layerItem, epsg):
+    # runs in a thread of the task manager, the layer must be handed over to
+    # the main thread before it can be added to the project
+    layer = createLayer(layerItem, epsg)
+    if not layer:
+        return None
+    layer.moveToThread(QCoreApplication.instance().thread())
+    return layer
+
+
+def setNodeChecked(node, checked):
+    if PYTHON_VERSION >= 3:
+        node.setItemVisibilityChecked(checked)
+    else:
+        node.setVisible(Qt.Checked if checked else Qt.Unchecked)
+
+
+def mirrorLayerTree(name, layerTree, layers):
+    ''' Returns a new QgsLayerTreeGroup name with the folders and layers of a
+    Shogun layer tree, ordered by their index and checked as in Shogun.
+    layers maps Shogun layer ids to the QGIS layers, a layer that is not in
+    layers is left out and so is every occurrence of a layer but the first'''
+    group = QgsLayerTreeGroup(name)
+    # the group is not part of the project yet, nothing has to be told
+    # about the nodes added to it
+    group.blockSignals(True)
+    setNodeChecked(group, layerTree.get('checked', True) is not False)
+    placed = set()
+    if layerTree.get('leaf'):
+        stack = [(layerTree, group)]
+    else:
+        stack = [(child, group) for child in sortedChildren(layerTree)]
+    # reversed, so that the first child is visited first and appended first
+    stack.reverse()
+    while len(stack) > 0:
+        node, parent = stack.pop()
+        checked = node.get('checked', True) is not False
+        if node.get('leaf'):
+            id = (node.get('layer') or {}).get('id')
+            if id not in layers or id in placed:
+                continue
+            placed.add(id)
+            treeLayer = QgsLayerTreeLayer(layers[id])
+            setNodeChecked(treeLayer, checked)
+            parent.addChildNode(treeLayer)
+        else:
+            folder = QgsLayerTreeGroup(node.get('text') or '')
+            setNodeChecked(folder, checked)
+            parent.addChildNode(folder)
+            stack.extend((child, folder) for child in reversed(sortedChildren(node)))
+    group.blockSignals(False)
+    return group
+
+
+class LayerBatchLoader(QObject):
+    ''' Adds many Shogun layers to QGIS at once. The layers that can be
+    created without asking the user are created in parallel background
+    tasks (their providers block on GetCapabilities), the styles of the
+    vector layers are downloaded in parallel meanwhile. When everything has
+    arrived all layers are added to the project in one operation while the
+    map canvas is frozen, and the canvas is refreshed once.
+
+    With a Shogun layerTree the layers are placed in a new group groupName
+    on top of the QGIS layer tree that has the folders of the Shogun tree,
+    it is inserted as a whole (see mirrorLayerTree())
+
+    finished is emitted with the QgisLayerItems that were added'''
+
+    finished = pyqtSignal(list)
+
+    def __init__(self, iface, layerItems, layerTree = None, groupName = None):
+        QObject.__init__(self)
+        self.iface = iface
+        self.layerItems = layerItems
+        self.layerTree = layerTree
+        self.groupName = groupName
+        # LayerItem.id -> created layer
+        self.layers = {}
+        # LayerItem.id -> PendingRequest of its style
+        self.styles = {}
+        self.tasks = []
+        self.remaining = 0
+        self.started = False
+
+    def start(self):
+        epsg = mapCanvasEpsg(self.iface)
+        background = []
+        for item in self.layerItems:
+            if item.datatype in ('vector', 'Vector'):
+                self.remaining += 1
+                self.styles[item.id] = item.ressource.requestStyle(item,
+                    callback = lambda pending: self.partFinished())
+            if PYTHON_VERSION >= 3 and item.datatype in UNATTENDED_DATATYPES:
+                background.append(item)
+            else:
+                # may ask the user, e.g. whether a raster is loaded as WMS
+                # or WCS, so it is created right here
+                self.layers[item.id] = createLayer(item, epsg)
+
+        self.remaining += len(background)
+        for item in background:
+            task = QgsTask.fromFunction('Loading Shogun layer ' + item.name,
+                createLayerInTask, item, epsg,
+                on_finished = self.taskFinished(item))
+            self.tasks.append(task)
+            QgsApplication.taskManager().addTask(task)
+        # styles that are answered right away must not finish the batch
+        # before all tasks are running
+        self.started = True
+        self.checkFinished()
+
+    def taskFinished(self, item):
+        def onFinished(exception, layer = None):
+            if exception is None:
+                self.layers[item.id] = layer
+            self.partFinished()
+        return onFinished
+
+    def partFinished(self):
+        self.remaining -= 1
+        self.checkFinished()
+
+    def checkFinished(self):
+        if self.started and self.remaining == 0:
+            self.started = False
+            self.addLayers()
+
+    def addLayers(self):
+        created = [(item, self.layers[item.id]) for item in self.layerItems
+                   if self.layers.get(item.id)]
+        qgisLayerItems = []
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            layers = [layer for item, layer in created]
+            addToLegend = self.layerTree is None
+            if PYTHON_VERSION >= 3:
+                QgsProject.instance().addMapLayers(layers, addToLegend)
+            else:
+                QgsMapLayerRegistry.instance().addMapLayers(layers, addToLegend)
+            if not addToLegend:
+                self.insertLayerTree(created)
+            for item, layer in created:
+                qgisLayerItem = QgisLayerItem(layer, item, item.ressource, register = False)
+                if layer.type() == QgsMapLayer.VectorLayer:
+                    self.applyStyle(qgisLayerItem)
+                item.attachQgsLayer(qgisLayerItem)
+                qgisLayerItems.append(qgisLayerItem)
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+        self.tasks = []
+        self.finished.emit(qgisLayerItems)
+
+    def insertLayerTree(self, created):
+        layers = dict((item.id, layer) for item, layer in created)
+        group = mirrorLayerTree(self.groupName or '', self.layerTree, layers)
+        # layers that are in the batch but not in the tree are put below
+        inTree = set(node.layerId() for node in group.findLayers())
+        for item, layer in created:
+            if layer.id() not in inTree:
+                group.addChildNode(QgsLayerTreeLayer(layer))
+                inTree.add(layer.id())
+        QgsProject.instance().layerTreeRoot().insertChildNode(0, group)
+
+    def applyStyle(self, qgisLayerItem):
+        pending = self.styles.get(qgisLayerItem.parentShogunLayer.id)
+        if pending is None:
+            # the data type of the layer was not known in advance
+            qgisLayerItem.downloadStyle()
+            return
+        handle, filename = tempfile.mkstemp(suffix = '.sld')
+        os.close(handle)
+        try:
+            sld, geoServerStyleName = qgisLayerItem.ressource.saveStyle(
+                pending.result(), filename)
+            qgisLayerItem.applyStyle(sld, geoServerStyleName)
+        except RequestsException:
+            pass
+        finally:
+            os.remove(filename)
@@ -36,6 +36,17 @@ PYTHON_VERSION = sys.version_info[0]
 
 '''This module contains some helper functions for the shogun-editor plugin'''
 
+# the data types of layers that createLayer() creates without asking the
+# user, so they can be created in a background task
+UNATTENDED_DATATYPES = ['vector', 'Vector', 'WMS']
+
+def mapCanvasEpsg(iface):
+    currentCrs = iface.mapCanvas().mapSettings().destinationCrs()
+    if currentCrs.isValid():
+        return currentCrs.authid()
+    else:
+        return 'EPSG:3857'
+
 def createLayer(layerItem, epsg):
     #Shogun Webapp saves all layers in the following espg, therefore the
     #variable can be static
@@ -55,9 +66,9 @@ def createLayer(layerItem, epsg):
     elif dataType == 'WMS':
         if layerurl == '/shogun2-webapp/geoserver.action':
             url = layerItem.ressource.baseurl.rstrip('/shogun2-webapp/') + layerurl + '?'
-            return createWmsLayerFromShogun(layerItem, url)
+            return createWmsLayerFromShogun(layerItem, url, epsg)
         else:
-            return createWmsLayer(layerItem, layerurl, epsg)
+            return createWmsLayerNormal(layerItem, layerurl, epsg)
 
     # if for any reason the parameter 'dataType' is not set correctly, we check the url
     # of the layer to determine if it's a WFS/WCS from the shogun-geoserver
@@ -145,12 +156,11 @@ def createRasterLayer(layerItem, url, epsg):
         else:
             url = baseurl + urllib.urlencode(params)
 
-        #urlretrieve stores the downloaded file in /tmp/ and returns it's path:
-        if PYTHON_VERSION >= 3:
-            response = urllib.request.urlretrieve(url)
-        else:
-            response = urllib.urlretrieve(url)
-        file = response[0]
+        #the coverage is streamed to a temporary file, so that large rasters
+        #are never held in memory as a whole
+        handle, file = tempfile.mkstemp(suffix = '.tif')
+        os.close(handle)
+        layerItem.ressource.downloadToFile(url, file)
         #create a raster layer and return it
         return QgsRasterLayer(file, 'QGIS-Layer: ' + layerItem.name)
 
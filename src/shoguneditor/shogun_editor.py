@@ -40,6 +40,7 @@ else:
     from . import resources2
 
 from .gui.editor import Editor
+from .connection.responsecache import flushSharedResponseCache
 
 
 class ShogunEditor:
@@ -100,6 +101,7 @@ class ShogunEditor:
 
 
     def unload(self):
+        flushSharedResponseCache()
         for action in self.actions:
             self.iface.removePluginWebMenu(
                 self.menu,